@@ -1,7 +1,13 @@
 from cutil.database import Database  # noqa: F401
+from cutil.async_database import AsyncDatabase  # noqa: F401
+from cutil.buffered_writer import BufferedWriter  # noqa: F401
 from cutil.config import Config  # noqa: F401
-from cutil.custom_terminal import CustomTerminal  # noqa: F401
-from cutil.repeating_timer import RepeatingTimer  # noqa: F401
+from cutil.custom_terminal import CustomTerminal, Progress  # noqa: F401
+from cutil.repeating_timer import RepeatingTimer, Scheduler  # noqa: F401
+from cutil.worker_pool import ThreadPool, ProcessPool, TaskResult  # noqa: F401
+from cutil.async_map import amap  # noqa: F401
+from cutil.rate_limiter import RateLimiter, SharedRateLimiter  # noqa: F401
+from cutil.metrics import MetricsRegistry, Histogram, default_registry  # noqa: F401
 
 import os
 import re
@@ -11,19 +17,22 @@ import math
 import time
 import pytz
 import json
-import queue
+import heapq
+import pickle
 import random
 import socket
 import urllib
 import hashlib
+import tempfile
+import inspect
+import itertools
 import logging
+import functools
 import datetime
-import threading
 import collections
 from hashids import Hashids
 from functools import wraps
 from operator import itemgetter
-from functools import cmp_to_key
 
 
 logger = logging.getLogger(__name__)
@@ -75,29 +84,39 @@ def str_to_date(timestamp, formats=["%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S
 # Threading
 ###
 def threads(num_threads, data, callback, *args, **kwargs):
-    q = queue.Queue()
+    """
+    Run `callback(item, *args, **kwargs)` for each item in `data` using `num_threads` threads
+    :return: list of the results in the order they finished, items that raised an exception are logged and skipped
+    """
     item_list = []
+    with ThreadPool(num_threads) as pool:
+        for task in pool.imap(callback, data, *args, ordered=False, **kwargs):
+            if task.exception is not None:
+                logger.error("Error in _thread_run callback {} with item:\n{}".format(callback.__name__, task.item),
+                             exc_info=task.exception)
+                continue
+            item_list.append(task.result)
 
-    def _thread_run():
-        while True:
-            item = q.get()
-            try:
-                item_list.append(callback(item, *args, **kwargs))
-            except Exception:
-                logger.exception("Error in _thread_run callback {} with item:\n{}".format(callback.__name__, item))
-            q.task_done()
+    return item_list
 
-    for i in range(num_threads):
-        t = threading.Thread(target=_thread_run)
-        t.daemon = True
-        t.start()
 
-    # Fill the Queue with the data to process
-    for item in data:
-        q.put(item)
+def processes(num_processes, data, callback, *args, chunk_size=None, initializer=None, initargs=(), **kwargs):
+    """
+    Same as `threads` but runs `callback(item, *args, **kwargs)` in `num_processes` processes
+    so cpu bound callbacks are not limited by the GIL. `callback` and the items must be picklable.
 
-    # Start processing the data
-    q.join()
+    Items are sent to the processes in chunks of `chunk_size` to cut down on the overhead.
+    `initializer(*initargs)` is called once in each process when it starts.
+    :return: list of the results, items that raised an exception are logged and skipped
+    """
+    item_list = []
+    with ProcessPool(num_processes, initializer=initializer, initargs=initargs) as pool:
+        for task in pool.imap(callback, data, *args, chunk_size=chunk_size, ordered=False, **kwargs):
+            if task.exception is not None:
+                logger.error("Error in process callback {} with item:\n{}".format(callback.__name__, task.item),
+                             exc_info=task.exception)
+                continue
+            item_list.append(task.result)
 
     return item_list
 
@@ -105,24 +124,105 @@ def threads(num_threads, data, callback, *args, **kwargs):
 ####
 # Other functions
 ####
-def multikey_sort(items, columns):
-    """Source: https://stackoverflow.com/questions/1143671/python-sorting-list-of-dictionaries-by-multiple-keys
+class _Reversed:
+    """ Wraps a value so it sorts in the opposite order, works for any type that can be compared """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _parse_sort_columns(columns):
     """
-    comparers = [
-        ((itemgetter(col[1:].strip()), -1) if col.startswith('-') else (itemgetter(col.strip()), 1))
-        for col in columns
-    ]
+    :return: list of (key, is_descending)
+    """
+    return [(col[1:].strip(), True) if col.startswith('-') else (col.strip(), False) for col in columns]
+
+
+def _sort_key(columns):
+    """
+    Build one key function for all of the columns
+    :return: tuple of (key function, reverse)
+    """
+    directions = {descending for _, descending in columns}
+    if len(directions) == 1:
+        return itemgetter(*[name for name, _ in columns]), directions.pop()
+
+    def key(item):
+        return tuple(_Reversed(item[name]) if descending else item[name] for name, descending in columns)
+    return key, False
+
+
+def _sort_list(items, columns):
+    """
+    Sort `items` in place
+    """
+    directions = {descending for _, descending in columns}
+    if len(directions) == 1:
+        items.sort(key=itemgetter(*[name for name, _ in columns]), reverse=directions.pop())
+    else:
+        # Python's sort is stable, so sorting by each column from last to first gives the same
+        # result as sorting by all of them at once, and every pass can use the fast C comparisons
+        for name, descending in reversed(columns):
+            items.sort(key=itemgetter(name), reverse=descending)
+    return items
+
+
+def _read_sort_run(run):
+    while True:
+        try:
+            block = pickle.load(run)
+        except EOFError:
+            return
+        yield from block
 
-    def cmp(a, b):
-        return (a > b) - (a < b)
 
-    def comparer(left, right):
-        comparer_iter = (
-            cmp(fn(left), fn(right)) * mult
-            for fn, mult in comparers
-        )
-        return next((result for result in comparer_iter if result), 0)
-    return sorted(items, key=cmp_to_key(comparer))
+def _external_sort(items, columns, chunk_size, tmp_dir):
+    key, reverse = _sort_key(columns)
+    runs = []
+    try:
+        for chunk in chunks_of(chunk_size, items):
+            run = tempfile.TemporaryFile(dir=tmp_dir)
+            runs.append(run)
+            for block in chunks_of(1000, _sort_list(list(chunk), columns)):
+                pickle.dump(block, run, pickle.HIGHEST_PROTOCOL)
+            run.seek(0)
+
+        yield from heapq.merge(*[_read_sort_run(run) for run in runs], key=key, reverse=reverse)
+
+    finally:
+        for run in runs:
+            run.close()
+
+
+def multikey_sort(items, columns, limit=None, chunk_size=None, tmp_dir=None):
+    """
+    Sort a list of dicts by multiple keys, prefix a key with `-` to sort by it in descending order
+
+    :param limit: Only return the first `limit` items. Uses a heap so only `limit` items are kept in memory
+    :param chunk_size: Sort more items than fit in memory. `chunk_size` items at a time are sorted and saved
+                       to a temp file in `tmp_dir`, then the files are merged. Items must be picklable.
+    :return: new sorted list, or a generator of the sorted items if `chunk_size` is set
+    """
+    columns = _parse_sort_columns(columns)
+
+    if limit is not None:
+        key, reverse = _sort_key(columns)
+        if reverse is True:
+            return heapq.nlargest(limit, items, key=key)
+        return heapq.nsmallest(limit, items, key=key)
+
+    if chunk_size is not None:
+        return _external_sort(items, columns, chunk_size, tmp_dir)
+
+    return _sort_list(list(items), columns)
 
 
 def get_internal_ip():
@@ -181,28 +281,153 @@ def rreplace(s, old, new, occurrence):
 
 
 def flatten(dict_obj, prev_key='', sep='_'):
+    """
+    Flatten nested dicts into a single dict, the keys of each level are joined with `sep`
+    {'a': {'b': 1}, 'c': 2} -> {'a_b': 1, 'c': 2}
+    """
     items = {}
-    for key, value in dict_obj.items():
-        new_key = prev_key + sep + key if prev_key != '' else key
-
-        if isinstance(value, dict):
-            items.update(flatten(value, new_key))
+    stack = [(prev_key, iter(dict_obj.items()))]
+    while stack:
+        key_prefix, level = stack[-1]
+        for key, value in level:
+            new_key = key_prefix + sep + str(key) if key_prefix != '' else str(key)
+
+            if isinstance(value, dict):
+                # Finish the nested dict before the rest of this one to keep the keys in order
+                stack.append((new_key, iter(value.items())))
+                break
+            else:
+                items[new_key] = value
         else:
-            items[new_key] = value
+            stack.pop()
 
     return items
 
 
-def update_dict(d, u):
+def unflatten(dict_obj, sep='_'):
+    """
+    Opposite of `flatten`, split each key on `sep` to rebuild the nested dicts
+    {'a_b': 1, 'c': 2} -> {'a': {'b': 1}, 'c': 2}
+    Only gives back the original dict if its keys do not contain `sep`
+    """
+    items = {}
+    for flat_key, value in dict_obj.items():
+        *path, last_key = flat_key.split(sep)
+        level = items
+        for key in path:
+            level = level.setdefault(key, {})
+            if not isinstance(level, dict):
+                raise ValueError("Key `{key}` is both a value and a nested dict".format(key=flat_key))
+        if isinstance(level.get(last_key), dict):
+            raise ValueError("Key `{key}` is both a value and a nested dict".format(key=flat_key))
+        level[last_key] = value
+
+    return items
+
+
+class _ShapeMismatch(Exception):
+    pass
+
+
+def compile_flattener(sample, sep='_'):
+    """
+    Build a function that flattens dicts with the same keys and nesting as `sample` the same way `flatten` does,
+    but with the key paths worked out ahead of time.
+
+    The function raises a `ValueError` if it is passed a dict with a different shape.
+    """
+    lines = []
+    leaves = []  # (flat key, local var name)
+    counter = itertools.count()
+
+    def add_level(var_name, level, key_prefix):
+        if any(not isinstance(key, (str, int)) for key in level):
+            raise ValueError("Only dicts with str and int keys can be compiled")
+        lines.append("if type({var}) is not _dict or len({var}) != {size}: raise _ShapeMismatch"
+                     .format(var=var_name, size=len(level)))
+        stack = [(var_name, iter(level.items()), key_prefix)]
+        while stack:
+            parent, items, prefix = stack[-1]
+            for key, value in items:
+                new_key = prefix + sep + str(key) if prefix != '' else str(key)
+                local = 'v{0}'.format(next(counter))
+                lines.append("{local} = {parent}[{key!r}]".format(local=local, parent=parent, key=key))
+                if isinstance(value, dict):
+                    lines.append("if type({var}) is not _dict or len({var}) != {size}: raise _ShapeMismatch"
+                                 .format(var=local, size=len(value)))
+                    stack.append((local, iter(value.items()), new_key))
+                    break
+                leaves.append((new_key, local))
+            else:
+                stack.pop()
+
+    add_level('record', sample, '')
+    if leaves:
+        lines.append("if " + " or ".join("isinstance({0}, _dict)".format(local) for _, local in leaves)
+                     + ": raise _ShapeMismatch")
+    lines.append("return {" + ", ".join("{0!r}: {1}".format(flat_key, local) for flat_key, local in leaves) + "}")
+
+    source = "def _compiled(record):\n" + "".join("    " + line + "\n" for line in lines)
+    namespace = {'_dict': dict, '_ShapeMismatch': _ShapeMismatch}
+    exec(compile(source, '<flattener>', 'exec'), namespace)
+    compiled = namespace['_compiled']
+
+    def flattener(record):
+        try:
+            return compiled(record)
+        except (_ShapeMismatch, KeyError, TypeError):
+            raise ValueError("Record does not have the same shape as the sample")
+
+    flattener.compiled = compiled
+    return flattener
+
+
+def flatten_records(records, sep='_', max_shapes=8):
     """
-    Source: https://stackoverflow.com/questions/3232943/update-value-of-a-nested-dictionary-of-varying-depth
+    Flatten each dict in a stream of dicts, yields the same results as `flatten`
+
+    A compiled flattener (see `compile_flattener`) is built for each new shape of record that is found,
+    up to `max_shapes` of the most recent shapes are kept. If most records have a shape of their own,
+    the records are flattened the normal way instead.
     """
-    for k, v in u.items():
-        if isinstance(v, collections.abc.Mapping):
-            r = update_dict(d.get(k, {}), v)
-            d[k] = r
+    compiled = []
+    hits = 0
+    misses = 0
+    for record in records:
+        for flattener in compiled:
+            try:
+                yield flattener(record)
+                hits += 1
+                break
+            except (_ShapeMismatch, KeyError, TypeError):
+                continue
         else:
-            d[k] = u[k]
+            misses += 1
+            yield flatten(record, sep=sep)
+            # Only keep compiling while it is paying off
+            if misses <= 10 or misses * 10 <= hits:
+                try:
+                    compiled.insert(0, compile_flattener(record, sep=sep).compiled)
+                except ValueError:
+                    continue
+                del compiled[max_shapes:]
+
+
+def update_dict(d, u):
+    """
+    Update `d` with the values of `u`, nested dicts are updated instead of replaced
+    """
+    stack = [(d, u)]
+    while stack:
+        target, source = stack.pop()
+        for k, v in source.items():
+            if isinstance(v, collections.abc.Mapping):
+                nested = target.get(k)
+                if not isinstance(nested, collections.abc.MutableMapping):
+                    nested = target[k] = {}
+                stack.append((nested, v))
+            else:
+                target[k] = v
     return d
 
 
@@ -216,7 +441,16 @@ def get_script_name(ext=False):
 def chunks_of(max_chunk_size, list_to_chunk):
     """
     Yields the list with a max size of max_chunk_size
+    Other iterables (like generators) are read max_chunk_size items at a time and yielded as lists
     """
+    if not hasattr(list_to_chunk, '__len__') or not hasattr(list_to_chunk, '__getitem__'):
+        items = iter(list_to_chunk)
+        chunk = list(itertools.islice(items, max_chunk_size))
+        while chunk:
+            yield chunk
+            chunk = list(itertools.islice(items, max_chunk_size))
+        return
+
     for i in range(0, len(list_to_chunk), max_chunk_size):
         yield list_to_chunk[i:i + max_chunk_size]
 
@@ -314,35 +548,114 @@ def dump_json(file_, data, **kwargs):
 price_pattern = re.compile(r'(?P<low>[\d,.\s]+)(?:\D*(?P<high>[\d,.\s]+))?')
 
 
-def parse_price(price):
-    found_price = {'low': None,
-                   'high': None
-                   }
-    price_raw = re.search(price_pattern, price)
-    if price_raw:
-        matched = price_raw.groupdict()
-        found_price['low'] = matched.get('low')
-        found_price['high'] = matched.get('high')
-
-    for key, value in found_price.items():
-        if value is not None:
-            value = value.strip()
-            new_value = value.replace(',', '').replace('.', '').replace(' ', '')
-            try:
-                # Check if price has cents
-                if value[-3] in [',', '.']:
-                    # Add . for cents back
-                    new_value = new_value[:-2] + '.' + new_value[-2:]
-            except IndexError:
-                # Price is 99 or less with no cents
-                pass
-
-            if new_value != '':
-                found_price[key] = float(new_value)
-            else:
-                found_price[key] = None
+@functools.lru_cache(maxsize=None)
+def _price_pattern(decimal, thousands):
+    """ `price_pattern` that also matches the separators that are not `,` or `.` """
+    extra = [re.escape(sep) for sep in (decimal, thousands) if sep is not None and sep not in (',', '.')]
+    if not extra:
+        return price_pattern
+    number = r'(?:[\d,.\s]|{extra})+'.format(extra='|'.join(extra))
+    return re.compile(r'(?P<low>{number})(?:\D*(?P<high>{number}))?'.format(number=number))
+
+
+def _parse_price_value(value, decimal, thousands):
+    # Remove all whitespace, including between the digits
+    value = ''.join(value.split())
+    if decimal is None:
+        if thousands is not None:
+            value = value.replace(thousands, '')
+        new_value = value.replace(',', '').replace('.', '')
+        # Check if price has cents
+        if len(value) >= 3 and value[-3] in (',', '.'):
+            # Add . for cents back
+            new_value = new_value[:-2] + '.' + new_value[-2:]
+    else:
+        new_value = value.replace(thousands, '').replace(decimal, '.')
+
+    if new_value == '':
+        return None
+    try:
+        return float(new_value)
+    except ValueError:
+        # More than 1 decimal separator
+        return None
+
+
+@functools.lru_cache(maxsize=65536)
+def _parse_price_parts(price, decimal, thousands):
+    """ Cached since the same price strings show up over and over
+    :return: tuple of (low, high)
+    """
+    price_raw = _price_pattern(decimal, thousands).search(price)
+    if not price_raw:
+        return None, None
+
+    low, high = price_raw.group('low', 'high')
+    return (_parse_price_value(low, decimal, thousands) if low is not None else None,
+            _parse_price_value(high, decimal, thousands) if high is not None else None)
+
 
-    return found_price
+def _price_separators(decimal, thousands):
+    for name, sep in (('decimal', decimal), ('thousands', thousands)):
+        if sep is not None and (not isinstance(sep, str) or sep == '' or any(char.isdigit() for char in sep)):
+            raise ValueError("`{name}` must be a string without any digits, got {sep!r}".format(name=name, sep=sep))
+    if decimal is not None and decimal == thousands:
+        raise ValueError("`decimal` and `thousands` can not be the same separator")
+
+    if decimal is not None and thousands is None:
+        thousands = '.' if decimal == ',' else ','
+    elif decimal is None and thousands in (',', '.'):
+        decimal = '.' if thousands == ',' else ','
+    return decimal, thousands
+
+
+def parse_price(price, decimal=None, thousands=None):
+    """
+    Get the low and high price from a string
+
+    :param decimal: Decimal separator of the price, like `,` for `1.234,56`. If `None` and `thousands` is `,` or `.`
+                    the other one is used, otherwise a `,` or `.` followed by 2 digits at the end of the price
+                    is used as the decimal separator
+    :param thousands: Thousands separator, like `'` for `1'234.56`.
+                      Defaults to whichever of `,` or `.` is not `decimal`
+    :return: dict of {'low': float or None, 'high': float or None}
+    """
+    low, high = _parse_price_parts(price, *_price_separators(decimal, thousands))
+    return {'low': low,
+            'high': high,
+            }
+
+
+def parse_prices(prices, decimal=None, thousands=None, as_numpy=False):
+    """
+    Same as `parse_price` for a list (or any iterable) of prices
+    Values that are not strings (like `None` or `NaN`) are treated as missing prices
+
+    :param as_numpy: If `True` return numpy float arrays, with NaN for missing prices
+    :return: dict of {'low': list or array, 'high': list or array}
+    """
+    decimal, thousands = _price_separators(decimal, thousands)
+    parse = _parse_price_parts
+    lows = []
+    highs = []
+    for price in prices:
+        if isinstance(price, str):
+            low, high = parse(price, decimal, thousands)
+        else:
+            low, high = None, None
+        lows.append(low)
+        highs.append(high)
+
+    if as_numpy is True:
+        import numpy as np  # pip install numpy
+        # None becomes NaN in a float array
+        return {'low': np.array(lows, dtype=np.float64),
+                'high': np.array(highs, dtype=np.float64),
+                }
+
+    return {'low': lows,
+            'high': highs,
+            }
 
 
 def get_image_dimension(url):
@@ -385,108 +698,75 @@ def crop_image(image_file, output_file=None, height=None, width=None, x=None, y=
 ####
 # Decorators
 ####
-def rate_limited(num_calls=1, every=1.0):
+def rate_limited(num_calls=1, every=1.0, burst=1, shared=None):
     """
-    Source: https://github.com/tomasbasham/ratelimit/tree/0ca5a616fa6d184fa180b9ad0b6fd0cf54c46936
-    Need to make a few changes that included having num_calls be a float
+    Prevent a method from being called more than `num_calls` times every `every` seconds.
+    Works on normal and async functions.
 
-    Prevent a method from being called
-    if it was previously called before
-    a time widows has elapsed.
+    Uses a `cutil.RateLimiter`, threads only share the lock long enough to reserve their turn,
+    the waiting is done outside of it. The limiter is available as `func.limiter` to get its stats.
 
     Keyword Arguments:
         num_calls (float): Maximum method invocations within a period. Must be greater than 0.
         every (float): A dampening factor (in seconds). Can be any number greater than 0.
+        burst (int): Number of calls that can be made right away after not being called for a while.
+        shared (str): Name of a limit to share with all processes on this host, see `cutil.SharedRateLimiter`.
+                      Every function and process using the same name counts against the same limit.
 
     Return:
         function: Decorated function that will forward method invocations if the time window has elapsed.
 
     """
-    frequency = abs(every) / float(num_calls)
-
     def decorator(func):
-        """
-        Extend the behaviour of the following
-        function, forwarding method invocations
-        if the time window hes elapsed.
-        Arguments:
-            func (function): The function to decorate
-
-        Returns:
-            function: Decorated function
-
-        """
-
-        # To get around issues with function local scope
-        # and reassigning variables, we wrap the time
-        # within a list. When updating the value we're
-        # not reassigning `last_called`, which would not
-        # work, but instead reassigning the value at a
-        # particular index.
-        last_called = [0.0]
-
-        # Add thread safety
-        lock = threading.RLock()
-
-        def wrapper(*args, **kargs):
-            """Decorator wrapper function"""
-            with lock:
-                elapsed = time.time() - last_called[0]
-                left_to_wait = frequency - elapsed
-                if left_to_wait > 0:
-                    time.sleep(left_to_wait)
-                last_called[0] = time.time()
-            return func(*args, **kargs)
-        return wrapper
+        if shared is not None:
+            return SharedRateLimiter(shared, num_calls, every, burst=burst)(func)
+        # Each decorated function gets its own limit
+        return RateLimiter(num_calls, every, burst=burst)(func)
     return decorator
 
 
 def rate_limited_old(max_per_second):
     """
-    Source: https://gist.github.com/gregburek/1441055
+    Same as `rate_limited(max_per_second)`, kept for backwards compatibility
+    Calls are no longer run one at a time, only their start times are spaced out
     """
-    lock = threading.Lock()
-    min_interval = 1.0 / max_per_second
+    return rate_limited(max_per_second)
 
-    def decorate(func):
-        last_time_called = time.perf_counter()
 
-        @wraps(func)
-        def rate_limited_function(*args, **kwargs):
-            lock.acquire()
-            nonlocal last_time_called
-            try:
-                elapsed = time.perf_counter() - last_time_called
-                left_to_wait = min_interval - elapsed
-                if left_to_wait > 0:
-                    time.sleep(left_to_wait)
-
-                return func(*args, **kwargs)
-            finally:
-                last_time_called = time.perf_counter()
-                lock.release()
-
-        return rate_limited_function
-
-    return decorate
-
-
-def timeit(stat_tracker_func, name):
+def timeit(stat_tracker_func=None, name=None, registry=None):
     """
-    Pass in a function and the name of the stat
-    Will time the function that this is a decorator to and send
-    the `name` as well as the value (in seconds) to `stat_tracker_func`
+    Time the function that this is a decorator to, works on normal and async functions.
+    The time is recorded even if the function raises an exception.
+
+    If `stat_tracker_func` is passed in it is called with `name` and the time (in seconds) after every call,
+    it can be used to either print out the data or save it.
 
-    `stat_tracker_func` can be used to either print out the data or save it
+    Otherwise the time is added to the histogram `name` in `registry` (a `cutil.MetricsRegistry`,
+    defaults to `cutil.metrics.default_registry`), which aggregates the times and sends them to its sink in batches.
+    `name` defaults to the name of the function.
     """
     def _timeit(func):
-        def wrapper(*args, **kw):
-            start_time = time.time()
-            result = func(*args, **kw)
-            stop_time = time.time()
-            stat_tracker_func(name, stop_time - start_time)
+        stat_name = name or func.__qualname__
+        if stat_tracker_func is None:
+            return (registry or default_registry).timer(stat_name)(func)
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kw):
+                start_time = time.perf_counter()
+                try:
+                    return await func(*args, **kw)
+                finally:
+                    stat_tracker_func(stat_name, time.perf_counter() - start_time)
+            return async_wrapper
 
-            return result
+        @wraps(func)
+        def wrapper(*args, **kw):
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kw)
+            finally:
+                stat_tracker_func(stat_name, time.perf_counter() - start_time)
         return wrapper
 
     return _timeit
@@ -0,0 +1,273 @@
+import logging
+from contextlib import asynccontextmanager
+
+from cutil.database import (DEFAULT_CHUNK_BYTES, _COLUMN_TYPES_SQL, _STAGE_ROW_NUM_SQL, _bulk_update_rows,
+                            _bulk_update_sql, _copy_sql, _copy_stream, _dsn, _get_columns, _insert_select_sql,
+                            _insert_sql, _peek_rows, _return_cols_sql, _stage_table_sql, _staging_upsert_sql,
+                            _update_statements, _upsert_sql, _value_batches)
+
+logger = logging.getLogger(__name__)
+
+# Size of the blocks of data sent during a COPY
+COPY_BLOCK_SIZE = 64 * 1024
+
+
+class AsyncDatabase:
+    """
+    asyncio version of `Database`, uses the same queries for `insert`, `upsert` and `update`
+    Connections come from a `psycopg_pool.AsyncConnectionPool` so many coroutines can share a few connections
+    """
+
+    def __init__(self, db_config, table_raw=None, max_connections=10, min_connections=1, pool_timeout=30.0):
+        from psycopg import AsyncClientCursor  # pip install psycopg psycopg_pool
+        from psycopg_pool import AsyncConnectionPool
+
+        self.table_raw = table_raw
+        # Client side binding so queries can be mogrify'd the same way as `Database` does
+        self.pool = AsyncConnectionPool(_dsn(db_config),
+                                        min_size=min_connections,
+                                        max_size=max_connections,
+                                        timeout=pool_timeout,
+                                        kwargs={'cursor_factory': AsyncClientCursor},
+                                        open=False)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self):
+        """
+        Open the pool, needs to be done inside of a running event loop.
+        `getcursor` will open the pool if it has not been opened yet
+        """
+        await self.pool.open()
+
+    async def close(self):
+        await self.pool.close()
+
+    @asynccontextmanager
+    async def getcursor(self, **kwargs):
+        if self.pool.closed:
+            await self.open()
+
+        # The pool commits when done, or does a rollback if there was an exception
+        async with self.pool.connection() as conn:
+            async with conn.cursor(**kwargs) as cur:
+                yield cur
+
+    async def get_column_types(self, cur, table):
+        """
+        Get the postgres type name of each column in the table
+        :return: dict of {column_name: type_name}
+        """
+        await cur.execute(_COLUMN_TYPES_SQL, (table,))
+        return dict(await cur.fetchall())
+
+    async def create_stage_table(self, cur, table, columns):
+        """
+        Create an empty temp table with the same column types as `columns` in `table`
+        The temp table is dropped when the transaction is committed
+        :return: name of the temp table
+        """
+        stage_table, query = _stage_table_sql(table, columns)
+        await cur.execute(query)
+        return stage_table
+
+    async def copy_rows(self, cur, table, columns, rows, copy_format='text'):
+        """
+        Stream `rows` into `table` using `COPY ... FROM STDIN`
+        :return: number of rows sent
+        """
+        query = _copy_sql(table, columns, copy_format)
+        column_types = await self.get_column_types(cur, table) if copy_format == 'binary' else None
+        stream = _copy_stream(columns, rows, copy_format, column_types=column_types)
+        async with cur.copy(query) as copy:
+            data = stream.read(COPY_BLOCK_SIZE)
+            while data:
+                await copy.write(data)
+                data = stream.read(COPY_BLOCK_SIZE)
+        return stream.row_count
+
+    async def _fetch_results(self, cur):
+        """
+        Get the rows of every result set of the last query, `None` if nothing was returned
+        """
+        results = None
+        while True:
+            if cur.description is not None:
+                if results is None:
+                    results = []
+                results.extend(await cur.fetchall())
+            if not cur.nextset():
+                break
+        return results
+
+    async def execute_values(self, cur, query_start, query_end, columns, rows, chunk_size=None,
+                             chunk_bytes=DEFAULT_CHUNK_BYTES, commit_chunks=False, row_template=None):
+        """
+        Run `query_start VALUES... query_end` once per batch of rows
+
+        :return: list of all rows returned by the queries, `None` if the queries do not return anything
+        """
+        results = None
+        for batch in _value_batches(cur.mogrify, rows, columns, row_template=row_template,
+                                    chunk_size=chunk_size, chunk_bytes=chunk_bytes):
+            await cur.execute(query_start + ','.join(batch) + query_end)
+            batch_results = await self._fetch_results(cur)
+            if batch_results is not None:
+                if results is None:
+                    results = []
+                results.extend(batch_results)
+            if commit_chunks is True:
+                await cur.connection.commit()
+
+        return results
+
+    async def _copy_insert(self, table, data_list, return_cols, copy_format, columns):
+        first_row, rows = _peek_rows(data_list)
+        if first_row is None:
+            # No need to continue
+            return []
+
+        columns = _get_columns(first_row, columns)
+        return_cols = _return_cols_sql(return_cols)
+
+        try:
+            async with self.getcursor() as cur:
+                if not return_cols:
+                    await self.copy_rows(cur, table, columns, rows, copy_format=copy_format)
+                    return None
+
+                stage_table = await self.create_stage_table(cur, table, columns)
+                await self.copy_rows(cur, stage_table, columns, rows, copy_format=copy_format)
+                await cur.execute(_insert_select_sql(table, columns, stage_table, return_cols))
+                return await cur.fetchall()
+
+        except Exception:
+            logger.debug("Error copying data into {table}".format(table=table))
+            raise
+
+    async def insert(self, table, data_list, return_cols='id', method='values', copy_format='text', columns=None,
+                     chunk_size=None, chunk_bytes=DEFAULT_CHUNK_BYTES, commit_chunks=False):
+        """
+        Same as `Database.insert`
+        """
+        if method == 'copy':
+            return await self._copy_insert(table, data_list, return_cols, copy_format, columns)
+        elif method != 'values':
+            raise ValueError("method must be either `values` or `copy`")
+
+        first_row, rows = _peek_rows(data_list)
+        if first_row is None:
+            # No need to continue
+            return []
+
+        columns = _get_columns(first_row, columns)
+        query_start, query_end = _insert_sql(table, columns, _return_cols_sql(return_cols))
+
+        try:
+            async with self.getcursor() as cur:
+                return await self.execute_values(cur, query_start, query_end, columns, rows,
+                                                 chunk_size=chunk_size,
+                                                 chunk_bytes=chunk_bytes,
+                                                 commit_chunks=commit_chunks)
+
+        except Exception:
+            logger.debug("Error inserting data into {table}".format(table=table))
+            raise
+
+    async def upsert(self, table, data_list, on_conflict_fields, on_conflict_action='update',
+                     on_conflict_where=None, update_fields=None, return_cols='id', columns=None,
+                     chunk_size=None, chunk_bytes=DEFAULT_CHUNK_BYTES, commit_chunks=False,
+                     method='values', copy_format='text'):
+        """
+        Same as `Database.upsert`
+        """
+        if method not in ('values', 'staging'):
+            raise ValueError("method must be either `values` or `staging`")
+
+        first_row, rows = _peek_rows(data_list)
+        if first_row is None:
+            # No need to continue
+            return []
+
+        columns = _get_columns(first_row, columns)
+        on_conflict_fields, conflict_sql = _upsert_sql(columns, on_conflict_fields, on_conflict_action,
+                                                       on_conflict_where, update_fields,
+                                                       _return_cols_sql(return_cols))
+
+        try:
+            async with self.getcursor() as cur:
+                if method == 'staging':
+                    stage_table = await self.create_stage_table(cur, table, columns)
+                    await cur.execute(_STAGE_ROW_NUM_SQL.format(stage_table=stage_table))
+                    await self.copy_rows(cur, stage_table, columns, rows, copy_format=copy_format)
+                    await cur.execute(_staging_upsert_sql(table, columns, on_conflict_fields, stage_table,
+                                                          conflict_sql))
+                    return await self._fetch_results(cur)
+
+                query_start, _ = _insert_sql(table, columns, '')
+                return await self.execute_values(cur, query_start, conflict_sql, columns, rows,
+                                                 chunk_size=chunk_size,
+                                                 chunk_bytes=chunk_bytes,
+                                                 commit_chunks=commit_chunks)
+
+        except Exception:
+            logger.debug("Error upserting data into {table}".format(table=table))
+            raise
+
+    async def update(self, table, data_list, matched_field=None, return_cols='id', columns=None, method='each',
+                     chunk_size=None, chunk_bytes=DEFAULT_CHUNK_BYTES, commit_chunks=False):
+        """
+        Same as `Database.update`, except `method='each'` returns the rows of every statement
+        """
+        if method not in ('each', 'bulk'):
+            raise ValueError("method must be either `each` or `bulk`")
+
+        if matched_field is None:
+            # Assume the id field
+            logger.info("Matched field not defined, assuming the `id` field")
+            matched_field = 'id'
+
+        first_row, rows = _peek_rows(data_list)
+        if first_row is None:
+            # No need to continue
+            return []
+
+        return_cols = _return_cols_sql(return_cols)
+        columns = _get_columns(first_row, columns)
+
+        try:
+            async with self.getcursor() as cur:
+                if method == 'bulk':
+                    column_types = await self.get_column_types(cur, table)
+                    value_columns, query_start, query_end, row_template = _bulk_update_sql(table, columns,
+                                                                                           matched_field,
+                                                                                           column_types,
+                                                                                           return_cols)
+                    results = await self.execute_values(cur, query_start, query_end, value_columns,
+                                                        _bulk_update_rows(rows, columns, matched_field),
+                                                        chunk_size=chunk_size,
+                                                        chunk_bytes=chunk_bytes,
+                                                        commit_chunks=commit_chunks,
+                                                        row_template=row_template)
+                    if results is None and return_cols:
+                        # No rows had a matched value to update with
+                        return []
+                    return results
+
+                query_list = [cur.mogrify(query, values)
+                              for query, values in _update_statements(table, rows, columns, matched_field,
+                                                                      return_cols)]
+                if not query_list:
+                    return []
+
+                await cur.execute(';'.join(query_list))
+                return await self._fetch_results(cur)
+
+        except Exception:
+            logger.debug("Error updating data in {table}".format(table=table))
+            raise
@@ -0,0 +1,99 @@
+import asyncio
+import inspect
+
+from cutil.rate_limiter import RateLimiter
+from cutil.worker_pool import TaskResult
+
+
+async def amap(callback, data, *args, concurrency=100, num_calls=None, every=1.0, burst=1,
+               ordered=False, **kwargs):
+    """
+    asyncio version of `ThreadPool.imap`, run `callback(item, *args, **kwargs)` for each item in `data`
+    with at most `concurrency` calls running at a time
+
+    Items are read from `data` only as fast as the results are used, so large (async) generators can be
+    processed with flat memory.
+
+    :param callback: Coroutine function, or a normal function that returns an awaitable or a value
+    :param data: Iterable or async iterable of items
+    :param num_calls: If set, start at most `num_calls` calls every `every` seconds with bursts of up to `burst`.
+                      Can also be a `RateLimiter` to share the limit with other code
+    :param ordered: If `True` the results are yielded in the same order as `data`,
+                    otherwise they are yielded as soon as they are done.
+                    Results held back for an earlier item count against `concurrency`
+    :return: async generator of `TaskResult(item, result, exception)`
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be >= 1")
+
+    if hasattr(data, '__aiter__'):
+        items = data.__aiter__()
+        is_async = True
+    else:
+        items = iter(data)
+        is_async = False
+
+    limiter = None
+    if isinstance(num_calls, RateLimiter):
+        limiter = num_calls
+    elif num_calls:
+        limiter = RateLimiter(num_calls, every, burst=burst)
+
+    results = asyncio.Queue()
+    tasks = set()
+
+    async def run(index, item):
+        if limiter is not None:
+            await limiter.wait_async()
+        try:
+            result = callback(item, *args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            task_result = TaskResult(item, result, None)
+        except Exception as e:
+            task_result = TaskResult(item, None, e)
+        results.put_nowait((index, task_result))
+
+    next_index = 0  # Index of the next item to start
+    yield_index = 0  # Index of the next result to yield when ordered
+    done = {}  # Finished results that are waiting for an earlier result when ordered
+    pending = 0  # Items started but not yet taken from `results`
+    items_left = True
+
+    try:
+        while True:
+            # Results waiting in `done` for an earlier item still count, so one slow item
+            # can not let the input run ahead
+            while items_left and pending + len(done) < concurrency:
+                try:
+                    if is_async:
+                        item = await items.__anext__()
+                    else:
+                        item = next(items)
+                except (StopIteration, StopAsyncIteration):
+                    items_left = False
+                    break
+                task = asyncio.ensure_future(run(next_index, item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                next_index += 1
+                pending += 1
+
+            if pending == 0:
+                break
+
+            index, task_result = await results.get()
+            pending -= 1
+            if ordered is not True:
+                yield task_result
+                continue
+
+            done[index] = task_result
+            while yield_index in done:
+                yield done.pop(yield_index)
+                yield_index += 1
+
+    finally:
+        # Stop any calls that are still running if the results are no longer wanted
+        for task in list(tasks):
+            task.cancel()
@@ -0,0 +1,245 @@
+import atexit
+import logging
+import threading
+import collections
+
+from cutil.repeating_timer import RepeatingTimer
+
+logger = logging.getLogger(__name__)
+
+
+def _estimate_size(row):
+    """ Rough size in bytes of a row, only used to decide when to flush
+    """
+    values = row.values() if isinstance(row, dict) else row
+    size = 0
+    for value in values:
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        else:
+            size += 8
+    return size
+
+
+class _Buffer:
+    __slots__ = ('key', 'operation', 'table', 'kwargs', 'rows', 'size', 'seq')
+
+    def __init__(self, key, operation, table, kwargs):
+        self.key = key
+        self.operation = operation
+        self.table = table
+        self.kwargs = kwargs
+        self.rows = []
+        self.size = 0
+        # Order the buffer was taken to be written in, buffers with the same key are written in this order
+        self.seq = None
+
+
+class BufferedWriter:
+    """
+    Collect rows passed to `insert`, `upsert` and `update` and write them using a `Database`
+    in large batches instead of one small transaction per call.
+
+    Rows are buffered per table/operation/arguments, and for `insert`, `upsert` and bulk `update` also per
+    set of dict keys since every row of a multi row query needs the same columns. A buffer is written when
+    it reaches `max_rows` rows or `max_bytes` (estimated) bytes, every `flush_interval` seconds,
+    on `flush()`/`close()` and when the program exits.
+
+    The call that fills up a buffer writes it before returning, so producers are slowed down to the speed
+    of the database instead of growing the buffer forever.
+
+    Buffers with the same table/operation/arguments are written one at a time in the order they were filled,
+    so an older batch of upserts/updates can not be committed after a newer one.
+
+    :param on_error: Function called with `(operation, table, rows, exception)` when writing a buffer fails,
+                     in `flush()`, `close()`, the background flush or when a full buffer is written by the call
+                     that filled it. By default a failed background flush is logged and the rows are dropped.
+                     Any other failed write puts the rows back in the buffer (so they are tried again) and
+                     raises the first error, the same is done if `on_error` raises.
+                     Either way the other buffers are still written.
+    """
+
+    def __init__(self, db, max_rows=1000, max_bytes=10 * 1024 * 1024, flush_interval=5.0, on_error=None):
+        self.db = db
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.on_error = on_error
+
+        self.rows_written = 0
+        self.flush_count = 0
+
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        # Next seq to give out per key (uses self._lock) and next seq allowed to write per key (uses _write_cond)
+        self._next_seq = collections.defaultdict(int)
+        self._write_cond = threading.Condition()
+        self._write_seq = collections.defaultdict(int)
+
+        self._timer = None
+        if flush_interval:
+            self._timer = RepeatingTimer(flush_interval, self._flush_on_timer, daemon=True)
+            self._timer.start()
+
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def insert(self, table, data, **kwargs):
+        """
+        Buffer rows to be written with `db.insert(table, rows, **kwargs)`
+        """
+        self._add('insert', table, data, kwargs)
+
+    def upsert(self, table, data, on_conflict_fields, **kwargs):
+        """
+        Buffer rows to be written with `db.upsert(table, rows, on_conflict_fields, **kwargs)`
+        """
+        kwargs['on_conflict_fields'] = on_conflict_fields
+        self._add('upsert', table, data, kwargs)
+
+    def update(self, table, data, **kwargs):
+        """
+        Buffer rows to be written with `db.update(table, rows, **kwargs)`
+        """
+        self._add('update', table, data, kwargs)
+
+    def _add(self, operation, table, data, kwargs):
+        if isinstance(data, (dict, tuple)):
+            data = [data]
+        # kwargs can have lists in them, so use the repr to group the rows
+        key = (operation, table, repr(sorted(kwargs.items())))
+        # Every row of a multi row insert/upsert/bulk update needs the same keys, `update` runs a query per row
+        by_row_keys = operation != 'update' or kwargs.get('method') == 'bulk'
+
+        full_buffers = []
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Can not add rows to a closed BufferedWriter")
+
+            for row in data:
+                row_key = key + (frozenset(row) if by_row_keys and isinstance(row, dict) else None,)
+                buffer = self._buffers.get(row_key)
+                if buffer is None:
+                    buffer = self._buffers[row_key] = _Buffer(row_key, operation, table, kwargs)
+                buffer.rows.append(row)
+                buffer.size += _estimate_size(row)
+
+                if len(buffer.rows) >= self.max_rows or buffer.size >= self.max_bytes:
+                    # Take the full buffer so other threads can keep adding rows while it is written
+                    full_buffers.append(self._take(row_key))
+
+        if full_buffers:
+            self._handle_failed(self._write_all(full_buffers))
+
+    def _take(self, key):
+        """ Remove a buffer so it can be written, must hold self._lock
+        """
+        buffer = self._buffers.pop(key)
+        buffer.seq = self._next_seq[key]
+        self._next_seq[key] += 1
+        return buffer
+
+    def _take_all(self):
+        with self._lock:
+            return [self._take(key) for key in list(self._buffers)]
+
+    def _put_back(self, buffer):
+        """ Put the rows of a buffer that failed to write back in front of any rows added since
+        """
+        with self._lock:
+            current = self._buffers.get(buffer.key)
+            if current is not None:
+                buffer.rows.extend(current.rows)
+                buffer.size += current.size
+            buffer.seq = None
+            self._buffers[buffer.key] = buffer
+
+    def _write(self, buffer):
+        with self._write_cond:
+            # Wait for the older buffers of the same key to be written first
+            while self._write_seq[buffer.key] != buffer.seq:
+                self._write_cond.wait()
+
+        try:
+            getattr(self.db, buffer.operation)(buffer.table, buffer.rows, **buffer.kwargs)
+            with self._lock:
+                self.rows_written += len(buffer.rows)
+                self.flush_count += 1
+        finally:
+            with self._write_cond:
+                self._write_seq[buffer.key] += 1
+                self._write_cond.notify_all()
+
+    def _write_all(self, buffers):
+        """ Write each buffer, a failed write does not stop the rest from being written
+        :return: list of (buffer, exception) for the buffers that failed
+        """
+        failed = []
+        for buffer in buffers:
+            try:
+                self._write(buffer)
+            except Exception as e:
+                failed.append((buffer, e))
+        return failed
+
+    def flush(self):
+        """
+        Write all buffered rows
+
+        If a buffer fails to write the others are still written. Each failure is passed to `on_error` if set,
+        otherwise the rows that failed are put back in the buffer and the first error is raised.
+        """
+        self._handle_failed(self._write_all(self._take_all()))
+
+    def _handle_failed(self, failed):
+        """ Pass each failed write to `on_error`, otherwise (or if `on_error` raises) put the rows back
+        and raise the first error once all of them are handled
+        """
+        errors = []
+        for buffer, e in failed:
+            if self.on_error is not None:
+                try:
+                    self.on_error(buffer.operation, buffer.table, buffer.rows, e)
+                    continue
+                except Exception as on_error_e:
+                    e = on_error_e
+            self._put_back(buffer)
+            errors.append(e)
+
+        if errors:
+            raise errors[0]
+
+    def _flush_on_timer(self):
+        # Nothing can be raised from here, the timer stops for good if its function raises
+        for buffer, e in self._write_all(self._take_all()):
+            if self.on_error is not None:
+                try:
+                    self.on_error(buffer.operation, buffer.table, buffer.rows, e)
+                    continue
+                except Exception:
+                    logger.exception("Error in on_error for {num_rows} buffered rows to {table}"
+                                     .format(num_rows=len(buffer.rows), table=buffer.table))
+            else:
+                logger.error("Error writing {num_rows} buffered rows to {table}"
+                             .format(num_rows=len(buffer.rows), table=buffer.table), exc_info=e)
+
+    def close(self):
+        """
+        Stop the flush timer and write any rows left in the buffer
+        If a write fails the rows are kept, see `flush()`, and can still be written by calling `flush()`
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        if self._timer is not None:
+            self._timer.cancel()
+        atexit.unregister(self.close)
+        self.flush()
@@ -1,4 +1,4 @@
-import os
+import sys
 import time
 import logging
 import threading
@@ -6,6 +6,80 @@ import threading
 
 logger = logging.getLogger(__name__)
 
+# ANSI escape codes used to redraw the block print display
+_CLEAR_SCREEN = '\x1b[2J\x1b[H'
+_CLEAR_LINE = '\x1b[2K'
+_MOVE_TO_LINE = '\x1b[{row};1H'
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{0}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+
+
+class Progress:
+    """
+    Thread safe progress counter that prints the count, items/sec and ETA using `CustomTerminal.cprint`
+
+    Call `update()` as often as needed, the line is only printed at most `fps` times a second
+    so the terminal does not slow down the work being counted.
+
+    :param total: Number of items expected, used to show the percent done and ETA
+    """
+
+    def __init__(self, terminal, total=None, desc='Processed', unit='items', fps=10):
+        self.terminal = terminal
+        self.total = total
+        self.desc = desc
+        self.unit = unit
+        self.interval = 1.0 / fps
+        self.count = 0
+
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+        self._next_print = self._start_time + self.interval
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def update(self, num=1):
+        """
+        Add `num` to the count
+        """
+        with self._lock:
+            self.count += num
+            now = time.monotonic()
+            if now >= self._next_print:
+                self._next_print = now + self.interval
+                # Print while holding the lock so lines from different threads do not mix
+                self.terminal.cprint(self._format(now))
+
+    def _format(self, now):
+        elapsed = now - self._start_time
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        if self.total:
+            line = "{desc}: {count}/{total} ({percent:.1f}%) {rate:.1f} {unit}/s".format(
+                desc=self.desc, count=self.count, total=self.total, percent=self.count / self.total * 100,
+                rate=rate, unit=self.unit)
+            if rate > 0 and self.count < self.total:
+                line += " ETA " + _format_seconds((self.total - self.count) / rate)
+            return line
+
+        return "{desc}: {count} {rate:.1f} {unit}/s".format(desc=self.desc, count=self.count, rate=rate,
+                                                            unit=self.unit)
+
+    def close(self):
+        """
+        Print the final count and move to the next line
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.terminal.cprint(self._format(now) + " in " + _format_seconds(now - self._start_time) + "\n")
+
 
 class CustomTerminal:
 
@@ -23,6 +97,10 @@ class CustomTerminal:
         self._bprint_messages = None
         # Block print display order (only items listed here will be displayed)
         self._bprint_order = None
+        # Lines drawn in the last frame
+        self._bprint_lines = None
+        self._bprint_stop = None
+        self._bprint_thread = None
 
     ####
     # Terminal/display related functions
@@ -45,36 +123,82 @@ class CustomTerminal:
             print('Processing...', end='\r')
             self._prev_cstr = 'Processing...'
 
-    def enable_bprint(self, bprint_msg={}, bprint_order=[]):
+    def progress(self, total=None, desc='Processed', unit='items', fps=10):
+        """
+        Create a `Progress` that displays its counts on the current line using `cprint`
+        """
+        return Progress(self, total=total, desc=desc, unit=unit, fps=fps)
+
+    def enable_bprint(self, bprint_msg={}, bprint_order=[], fps=2):
+        """
+        Start redrawing the block print display `fps` times a second from a background thread
+        Only the lines that changed since the last frame are redrawn
+        """
+        self.disable_bprint()
+
         # Block print display messages and values
-        self.bprint_messages = bprint_msg
+        self._bprint_messages = bprint_msg
 
         # Block print display order (only items listed here will be displayed)
-        self.bprint_order = bprint_order
+        self._bprint_order = bprint_order
 
         # Start instance of block print
-        self._bprint_display()
+        self._bprint_disable = False
+        self._bprint_lines = None
+        self._bprint_stop = threading.Event()
+        self._bprint_thread = threading.Thread(target=self._bprint_loop, args=(1.0 / fps, self._bprint_stop))
+        self._bprint_thread.daemon = True
+        self._bprint_thread.start()
 
     def disable_bprint(self):
-        self.bprint_disable = True
+        """
+        Stop the block print display after drawing the latest values one last time
+        """
+        self._bprint_disable = True
+        if self._bprint_thread is not None:
+            self._bprint_stop.set()
+            if self._bprint_thread is not threading.current_thread():
+                self._bprint_thread.join()
+            self._bprint_thread = None
 
     def bprint(self, bmsg, line):
         """
         bprint: Block Print
-        self.bprint_messages[line][0] is always the display text
-        self.bprint_messages[line][1] is always the value
-        """
-        self.bprint_messages[line][1] = bmsg
+        self._bprint_messages[line][0] is always the display text
+        self._bprint_messages[line][1] is always the value
 
-    def _bprint_display(self):
-        self.bprint_messages['title'][1] = time.time()
+        Only the latest value set between frames is displayed
+        """
+        self._bprint_messages[line][1] = bmsg
 
-        os.system('cls' if os.name == 'nt' else 'clear')
-        for item in self.bprint_order:
-            print(self.bprint_messages[item][0] + ": " + str(self.bprint_messages[item][1]))
+    def _bprint_loop(self, interval, stop):
+        self._bprint_display()
+        # Update terminal every `interval` seconds
+        while not stop.wait(interval):
+            self._bprint_display()
+        self._bprint_display()
 
-        if self.bprint_disable is not True:
-            # Update terminal every n seconds
-            t_reload = threading.Timer(.5, self._bprint_display)
-            t_reload.setDaemon(True)
-            t_reload.start()
+    def _bprint_display(self):
+        if 'title' in self._bprint_messages:
+            self._bprint_messages['title'][1] = time.time()
+
+        lines = [self._bprint_messages[item][0] + ": " + str(self._bprint_messages[item][1])
+                 for item in self._bprint_order]
+
+        prev_lines = self._bprint_lines
+        if prev_lines is None or len(prev_lines) != len(lines):
+            # Clear the screen and draw every line
+            output = _CLEAR_SCREEN + '\n'.join(lines) + '\n'
+        else:
+            # Move the cursor to each line that changed and redraw just that line
+            output = ''.join(_MOVE_TO_LINE.format(row=row) + _CLEAR_LINE + line
+                             for row, (prev_line, line) in enumerate(zip(prev_lines, lines), start=1)
+                             if line != prev_line)
+            if not output:
+                return
+            # Leave the cursor under the block
+            output += _MOVE_TO_LINE.format(row=len(lines) + 1)
+
+        self._bprint_lines = lines
+        sys.stdout.write(output)
+        sys.stdout.flush()
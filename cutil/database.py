@@ -1,40 +1,635 @@
-import copy
+import re
+import json
+import time
+import uuid
+import struct
 import logging
+import datetime
+import itertools
+import threading
+from functools import wraps
 from contextlib import contextmanager
 
+from cutil.database_pool import BlockingConnectionPool, _Timing
+from cutil.query_cache import QueryCache, normalize_table, tables_in_query
+
 logger = logging.getLogger(__name__)
 
+# Header and trailer of the postgres binary COPY format
+_COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+_COPY_BINARY_TRAILER = struct.pack('!h', -1)
+_PG_EPOCH_DATE = datetime.date(2000, 1, 1)
+_PG_EPOCH = datetime.datetime(2000, 1, 1)
+_PG_EPOCH_TZ = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+# Max size of a single multi row query, postgres can not take queries over 1GB
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+_copy_text_special = re.compile(r'[\\\t\n\r]')
+_copy_text_escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
 
-def _check_values(in_values):
-    """ Check if values need to be converted before they get mogrify'd
+def _return_cols_sql(return_cols):
+    """ Build the `RETURNING ...` part of a query, blank if nothing should be returned
     """
-    out_values = []
-    for value in in_values:
-        # if isinstance(value, (dict, list)):
-        #     out_values.append(json.dumps(value))
-        # else:
-        out_values.append(value)
+    if return_cols is None or len(return_cols) == 0 or return_cols[0] is None:
+        return ''
+    if not isinstance(return_cols, list):
+        return_cols = [return_cols]
+    return 'RETURNING ' + ','.join(return_cols)
 
-    return tuple(out_values)
 
+def _peek_rows(data_list):
+    """ Get the first row of `data_list` without consuming it
 
-class Database:
+    Returns the tuple `(first_row, rows)` where `rows` still includes the first row.
+    `first_row` is `None` if there is no data
+    """
+    if isinstance(data_list, dict):
+        data_list = [data_list]
+    rows = iter(data_list)
+    first_row = next(rows, None)
+    if first_row is None:
+        return None, iter(())
+    return first_row, itertools.chain([first_row], rows)
 
-    def __init__(self, db_config, table_raw=None, max_connections=10):
-        from psycopg2.pool import ThreadedConnectionPool
 
-        self.table_raw = table_raw
-        # Set default port is port is not set
-        if not db_config.get('db_port'):
-            db_config['db_port'] = 5432
+def _get_columns(first_row, columns):
+    """ Get the column names for the data, from `columns` if set otherwise the keys of the first row
+    """
+    if columns is not None:
+        return list(columns)
+    if not isinstance(first_row, dict):
+        raise ValueError("Data must be a list of dicts, or pass in `columns` when using a list of tuples")
+    return list(first_row.keys())
+
+
+def _row_values(row, columns):
+    """ Get the values of a dict or sequence row in the order of `columns`
+
+    Dict rows must have exactly the keys in `columns`, otherwise missing keys would be written as NULL
+    and extra keys would be dropped
+    """
+    if isinstance(row, dict):
+        try:
+            values = [row[column] for column in columns]
+        except KeyError:
+            values = None
+        if values is None or len(row) != len(columns):
+            raise ValueError("All rows must have the same keys, expected {expected} but got {keys}"
+                             .format(expected=sorted(columns), keys=sorted(row.keys())))
+        return values
+    return row
+
+
+def _copy_array(value):
+    """ Convert a list to a postgres array literal like `{"a","b"}`, the same as a list is sent as an
+    ARRAY when using `method='values'`
+    """
+    elements = []
+    for element in value:
+        if element is None:
+            elements.append('NULL')
+        elif isinstance(element, list):
+            elements.append(_copy_array(element))
+        else:
+            elements.append('"' + _copy_str(element).replace('\\', '\\\\').replace('"', '\\"') + '"')
+    return '{' + ','.join(elements) + '}'
+
+
+def _copy_str(value):
+    """ Convert a value to the string postgres expects for a text/csv COPY
+    """
+    if type(value) is str:
+        return value
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        return _copy_array(value)
+    if isinstance(value, dict):
+        return json.dumps(value, default=str)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(value).hex()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def _encode_copy_text(values):
+    fields = []
+    for value in values:
+        value_type = type(value)
+        if value is None:
+            fields.append('\\N')
+        elif value_type is str:
+            # Most strings do not need escaping, translate is much slower then the check
+            fields.append(value.translate(_copy_text_escapes) if _copy_text_special.search(value) else value)
+        elif value_type is int or value_type is float:
+            fields.append(str(value))
+        else:
+            fields.append(_copy_str(value).translate(_copy_text_escapes))
+    return ('\t'.join(fields) + '\n').encode('utf-8')
+
+
+def _encode_copy_csv(values):
+    fields = []
+    for value in values:
+        value_type = type(value)
+        if value is None:
+            fields.append('')
+        elif value_type is int or value_type is float:
+            fields.append(str(value))
+        else:
+            # Quote every string so an empty string is not read in as NULL
+            fields.append('"' + _copy_str(value).replace('"', '""') + '"')
+    return (','.join(fields) + '\n').encode('utf-8')
+
+
+def _binary_json(value):
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return json.dumps(value, default=str).encode('utf-8')
+
+
+def _binary_timestamptz(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    delta = value - _PG_EPOCH_TZ
+    return struct.pack('!q', (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+
+def _binary_timestamp(value):
+    delta = value - _PG_EPOCH
+    return struct.pack('!q', (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+
+def _binary_uuid(value):
+    if not isinstance(value, uuid.UUID):
+        value = uuid.UUID(str(value))
+    return value.bytes
+
+
+# Binary COPY encoders by postgres type name
+_copy_binary_encoders = {
+    'bool': lambda v: struct.pack('!?', v),
+    'int2': lambda v: struct.pack('!h', v),
+    'int4': lambda v: struct.pack('!i', v),
+    'int8': lambda v: struct.pack('!q', v),
+    'float4': lambda v: struct.pack('!f', v),
+    'float8': lambda v: struct.pack('!d', v),
+    'text': lambda v: str(v).encode('utf-8'),
+    'varchar': lambda v: str(v).encode('utf-8'),
+    'bpchar': lambda v: str(v).encode('utf-8'),
+    'name': lambda v: str(v).encode('utf-8'),
+    'citext': lambda v: str(v).encode('utf-8'),
+    'bytea': bytes,
+    'json': _binary_json,
+    'jsonb': lambda v: b'\x01' + _binary_json(v),
+    'uuid': _binary_uuid,
+    'date': lambda v: struct.pack('!i', (v - _PG_EPOCH_DATE).days),
+    'timestamp': _binary_timestamp,
+    'timestamptz': _binary_timestamptz,
+}
+
+
+def _binary_row_encoder(column_types):
+    """ Create a function that encodes a row into the binary COPY format
+
+    :param column_types: list of postgres type names, in the order of the columns
+    """
+    encoders = []
+    for type_name in column_types:
+        if type_name not in _copy_binary_encoders:
+            raise ValueError("Binary COPY does not support columns of type `{type_name}`, use the text or csv format"
+                             .format(type_name=type_name))
+        encoders.append(_copy_binary_encoders[type_name])
+    row_header = struct.pack('!h', len(encoders))
+
+    def _encode_copy_binary(values):
+        parts = [row_header]
+        for encoder, value in zip(encoders, values):
+            if value is None:
+                parts.append(b'\xff\xff\xff\xff')
+            else:
+                data = encoder(value)
+                parts.append(struct.pack('!i', len(data)))
+                parts.append(data)
+        return b''.join(parts)
+
+    return _encode_copy_binary
+
+
+class _CopyStream:
+    """ File like object that encodes rows as they are read by `cursor.copy_expert`
+
+    Only `size` bytes worth of rows are held in memory at a time
+    """
+
+    def __init__(self, rows, columns, encode_row, header=b'', trailer=b''):
+        self._rows = rows
+        self._columns = columns
+        self._encode_row = encode_row
+        self._buffer = bytearray(header)
+        self._trailer = trailer
+        self._done = False
+        self.row_count = 0
+        # Error raised while encoding the rows, the driver only reports that the read failed
+        self.error = None
+
+    def read(self, size=-1):
+        while not self._done and (size is None or size < 0 or len(self._buffer) < size):
+            row = next(self._rows, None)
+            if row is None:
+                self._buffer += self._trailer
+                self._done = True
+                break
+            try:
+                self._buffer += self._encode_row(_row_values(row, self._columns))
+            except Exception as e:
+                self.error = e
+                raise
+            self.row_count += 1
+
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+# NumPy dtypes to use for the postgres type oids in `cursor.description`
+_NUMPY_DTYPES = {16: 'bool',  # bool
+                 20: 'int64',  # int8
+                 21: 'int64',  # int2
+                 23: 'int64',  # int4
+                 700: 'float64',  # float4
+                 701: 'float64',  # float8
+                 1700: 'float64',  # numeric
+                 1082: 'datetime64[D]',  # date
+                 1114: 'datetime64[us]',  # timestamp
+                 1184: 'datetime64[us]',  # timestamptz, converted to utc
+                 }
+
+
+def _numpy_chunk(np, values, dtype):
+    """ Convert a list of values from a single column into a numpy array
+    """
+    if dtype in ('int64', 'bool') and None in values:
+        # Ints with NULLs become floats with NaN, bools with NULLs are kept as python objects
+        dtype = 'float64' if dtype == 'int64' else object
+    elif dtype == 'datetime64[us]':
+        values = [value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+                  if value is not None and value.tzinfo is not None else value
+                  for value in values]
+    try:
+        return np.array(values, dtype=dtype)
+    except (TypeError, ValueError):
+        return np.array(values, dtype=object)
+
+
+####
+# Query builders, shared by `Database` and `AsyncDatabase`
+####
+_COLUMN_TYPES_SQL = """SELECT a.attname, t.typname
+                       FROM pg_attribute a
+                       JOIN pg_type t ON t.oid = a.atttypid
+                       WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+                    """
+_COPY_OPTIONS = {'text': '',
+                 'csv': 'WITH (FORMAT csv)',
+                 'binary': 'WITH (FORMAT binary)',
+                 }
+
+
+def _dsn(db_config):
+    # Set default port is port is not set
+    if not db_config.get('db_port'):
+        db_config['db_port'] = 5432
+    return "dbname={db_name} user={db_user} host={db_host} password={db_pass} port={db_port}".format(**db_config)
+
+
+def _quote_fields(columns):
+    return '"{0}"'.format('","'.join(columns))
+
+
+def _stage_table_sql(table, columns):
+    """ Query to create an empty temp table with the same column types as `columns` in `table`
+    :return: tuple of (stage_table, query)
+    """
+    stage_table = '_cutil_stage_{uid}'.format(uid=uuid.uuid4().hex)
+    query = "CREATE TEMP TABLE {stage_table} ON COMMIT DROP AS SELECT {fields} FROM {table} WITH NO DATA"\
+            .format(stage_table=stage_table, fields=_quote_fields(columns), table=table)
+    return stage_table, query
+
+
+def _copy_sql(table, columns, copy_format):
+    if copy_format not in _COPY_OPTIONS:
+        raise ValueError("copy_format must be one of `text`, `csv` or `binary`")
+    return "COPY {table} ({fields}) FROM STDIN {options}"\
+           .format(table=table, fields=_quote_fields(columns), options=_COPY_OPTIONS[copy_format])
+
+
+def _copy_stream(columns, rows, copy_format, column_types=None):
+    """ Create the stream of encoded rows for a COPY
+    `column_types` ({column_name: type_name}) is only needed for the binary format
+    """
+    if copy_format == 'text':
+        return _CopyStream(rows, columns, _encode_copy_text)
+    elif copy_format == 'csv':
+        return _CopyStream(rows, columns, _encode_copy_csv)
+    elif copy_format == 'binary':
+        encode_row = _binary_row_encoder([column_types[column] for column in columns])
+        return _CopyStream(rows, columns, encode_row, header=_COPY_BINARY_HEADER, trailer=_COPY_BINARY_TRAILER)
+    raise ValueError("copy_format must be one of `text`, `csv` or `binary`")
 
-        self.pool = ThreadedConnectionPool(minconn=1,
+
+def _insert_select_sql(table, columns, stage_table, return_cols):
+    return "INSERT INTO {table} ({fields}) SELECT {fields} FROM {stage_table} {return_cols}"\
+           .format(table=table, fields=_quote_fields(columns), stage_table=stage_table, return_cols=return_cols)
+
+
+def _insert_sql(table, columns, return_cols):
+    """ :return: tuple of (query_start, query_end) to go around the VALUES of an insert
+    """
+    query_start = "INSERT INTO {table} ({fields}) VALUES "\
+                  .format(table=table,
+                          fields=_quote_fields(columns),
+                          )
+    return query_start, ' ' + return_cols
+
+
+def _upsert_sql(columns, on_conflict_fields, on_conflict_action, on_conflict_where, update_fields, return_cols):
+    """ Build the `ON CONFLICT ...` part of an upsert
+    :return: tuple of (on_conflict_fields, conflict_sql)
+    """
+    # Make sure on_conflict_fields is a list
+    if not isinstance(on_conflict_fields, list):
+        on_conflict_fields = [on_conflict_fields]
+    # Make sure on_conflict_fields has data
+    if len(on_conflict_fields) == 0 or on_conflict_fields[0] is None:
+        # No need to continue
+        raise ValueError("Must pass in `on_conflict_fields` argument")
+
+    # Support for partial index on table
+    if on_conflict_where:
+        on_conflict_where = f'WHERE {on_conflict_where}'
+    else:
+        on_conflict_where = ''
+
+    # Make sure update_fields is a list/valid
+    if on_conflict_action == 'update':
+        if not isinstance(update_fields, list):
+            update_fields = [update_fields]
+        # If noting is passed in, set `update_fields` to all (data_list-on_conflict_fields)
+        if len(update_fields) == 0 or update_fields[0] is None:
+            update_fields = list(set(columns) - set(on_conflict_fields))
+            # If update_fields is empty here that could only mean that all fields are set as conflict_fields
+            if len(update_fields) == 0:
+                raise ValueError("Not all the fields can be `on_conflict_fields` when doing an update")
+
+        # If everything is good to go with the update fields
+        fields_update_tmp = []
+        for key in update_fields:
+            fields_update_tmp.append('"{0}"="excluded"."{0}"'.format(key))
+        conflict_action_sql = 'UPDATE SET {update_fields}'\
+                              .format(update_fields=', '.join(fields_update_tmp))
+    else:
+        # Do nothing on conflict
+        conflict_action_sql = 'NOTHING'
+
+    conflict_sql = """
+                   ON CONFLICT ({on_conflict_fields}) {on_conflict_where} DO
+                   {conflict_action_sql}
+                   {return_cols}
+                   """.format(on_conflict_fields=','.join(on_conflict_fields),
+                              on_conflict_where=on_conflict_where,
+                              conflict_action_sql=conflict_action_sql,
+                              return_cols=return_cols,
+                              )
+    return on_conflict_fields, conflict_sql
+
+
+def _staging_upsert_sql(table, columns, on_conflict_fields, stage_table, conflict_sql):
+    """ Merge the rows of the stage table into `table`, the last row of any duplicate `on_conflict_fields` wins
+
+    `DISTINCT ON` treats NULLs as equal but a unique index does not, so rows with a NULL in any of the
+    `on_conflict_fields` are not de-duplicated, the same as when they are inserted with `VALUES`.
+    The stage table must have the `_cutil_row_num` column (see `_STAGE_ROW_NUM_SQL`)
+    """
+    fields = _quote_fields(columns)
+    conflict_fields = ','.join(on_conflict_fields)
+    return """INSERT INTO {table} ({fields})
+              SELECT {fields} FROM (
+                  (SELECT DISTINCT ON ({conflict_fields}) {fields}, "_cutil_row_num"
+                   FROM {stage_table}
+                   WHERE {not_null}
+                   ORDER BY {conflict_fields}, "_cutil_row_num" DESC)
+                  UNION ALL
+                  (SELECT {fields}, "_cutil_row_num"
+                   FROM {stage_table}
+                   WHERE {any_null})
+              ) AS _cutil_dedup
+              ORDER BY "_cutil_row_num"
+              {conflict_sql}
+           """.format(table=table,
+                      fields=fields,
+                      conflict_fields=conflict_fields,
+                      not_null=' AND '.join('{0} IS NOT NULL'.format(field) for field in on_conflict_fields),
+                      any_null=' OR '.join('{0} IS NULL'.format(field) for field in on_conflict_fields),
+                      stage_table=stage_table,
+                      conflict_sql=conflict_sql,
+                      )
+
+
+# Keep track of the order the rows came into the stage table in
+_STAGE_ROW_NUM_SQL = 'ALTER TABLE {stage_table} ADD COLUMN "_cutil_row_num" bigserial'
+
+
+def _log_missing_matched_field(matched_field, row):
+    logger.debug("Cannot update row. Missing field {field} in data {data}"
+                 .format(field=matched_field, data=row))
+    logger.error("Cannot update row. Missing field {field} in data".format(field=matched_field))
+
+
+def _update_statements(table, rows, columns, matched_field, return_cols):
+    """ Yield a tuple of (query, values) to update each row, rows missing `matched_field` are skipped
+    """
+    for row in rows:
+        # Read the values without changing the row that was passed in
+        if isinstance(row, dict):
+            row_columns = row.keys()
+            values = row.values()
+        else:
+            row_columns = columns
+            values = row
+        set_columns = []
+        set_values = []
+        matched_value = None
+        for column, value in zip(row_columns, values):
+            if column == matched_field:
+                matched_value = value
+            else:
+                set_columns.append(column)
+                set_values.append(value)
+
+        if matched_value is None:
+            _log_missing_matched_field(matched_field, row)
+            continue
+
+        query = "UPDATE {table} SET {data} WHERE {matched_field}=%s {return_cols}"\
+                .format(table=table,
+                        data=','.join("%s=%%s" % u for u in set_columns),
+                        matched_field=matched_field,
+                        return_cols=return_cols
+                        )
+        set_values.append(matched_value)
+        yield query, set_values
+
+
+def _bulk_update_sql(table, columns, matched_field, column_types, return_cols):
+    """ Build a set based `UPDATE ... FROM (VALUES ...)`
+    The rows must be passed through `_bulk_update_rows` so the matched field is first
+
+    :return: tuple of (value_columns, query_start, query_end, row_template)
+    """
+    if matched_field not in columns:
+        raise ValueError("Cannot update rows. Missing field {field} in data".format(field=matched_field))
+    set_columns = [column for column in columns if column != matched_field]
+    if len(set_columns) == 0:
+        raise ValueError("There are no fields to update besides `{field}`".format(field=matched_field))
+    # Match field first, followed by the fields to update
+    value_columns = [matched_field] + set_columns
+
+    # Cast the values to the column types, VALUES would otherwise treat strings as text
+    row_template = '({0})'.format(','.join('%s::"{0}"'.format(column_types[column]) for column in value_columns))
+    value_names = ['_c{0}'.format(i) for i in range(len(value_columns))]
+    query_start = "UPDATE {table} SET {data} FROM (VALUES "\
+                  .format(table=table,
+                          data=','.join('"{0}"=_cutil_values.{1}'.format(column, name)
+                                        for column, name in zip(set_columns, value_names[1:])),
+                          )
+    query_end = """) AS _cutil_values ({value_names})
+                WHERE {table}."{matched_field}"=_cutil_values.{matched_name}
+                {return_cols}
+                """.format(value_names=','.join(value_names),
+                           table=table,
+                           matched_field=matched_field,
+                           matched_name=value_names[0],
+                           return_cols=return_cols,
+                           )
+    return value_columns, query_start, query_end, row_template
+
+
+def _bulk_update_rows(rows, columns, matched_field):
+    """ Yield the values of each row with the matched field first, rows missing `matched_field` are skipped
+
+    Every column is set on every row, so dict rows must have exactly the keys in `columns`.
+    Otherwise missing keys would be written as NULL and extra keys would be dropped.
+    """
+    matched_index = columns.index(matched_field)
+    column_set = set(columns)
+    for row in rows:
+        if isinstance(row, dict) and row.keys() != column_set:
+            raise ValueError("All rows must have the same keys when using `method='bulk'`, expected {expected} "
+                             "but got {keys}. Use `method='each'` to update rows with different keys"
+                             .format(expected=sorted(column_set), keys=sorted(row.keys())))
+        values = _row_values(row, columns)
+        if values[matched_index] is None:
+            _log_missing_matched_field(matched_field, row)
+            continue
+        yield [values[matched_index]] + [value for i, value in enumerate(values) if i != matched_index]
+
+
+def _value_batches(mogrify, rows, columns, row_template=None, chunk_size=None, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """ Mogrify each row on its own and yield lists of them with at most `chunk_size` rows and `chunk_bytes` bytes
+
+    `row_template` defaults to `(%s,%s,...)` with a `%s` for each column
+    """
+    if row_template is None:
+        row_template = '({0})'.format(','.join(['%s'] * len(columns)))
+
+    batch = []
+    batch_bytes = 0
+    for row in rows:
+        value = mogrify(row_template, _row_values(row, columns))
+        if batch and ((chunk_size and len(batch) >= chunk_size)
+                      or (chunk_bytes and batch_bytes + len(value) > chunk_bytes)):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(value)
+        batch_bytes += len(value) + 1
+
+    if batch:
+        yield batch
+
+
+def _timed(func):
+    """ Keep track of how long each call of a `Database` method takes
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start_time
+            with self._stats_lock:
+                self._method_timings.setdefault(func.__name__, _Timing()).add(duration)
+    return wrapper
+
+
+def _invalidates_cache(func):
+    """ Remove the cached results of the table a `Database` method writes to
+    """
+    @wraps(func)
+    def wrapper(self, table, *args, **kwargs):
+        try:
+            return func(self, table, *args, **kwargs)
+        finally:
+            self._invalidate_table(table)
+    return wrapper
+
+
+class Database:
+
+    def __init__(self, db_config, table_raw=None, max_connections=10, block=False, pool_timeout=None,
+                 cache_size=None, cache_ttl=None):
+        self.table_raw = table_raw
+        # With `block=True` wait up to `pool_timeout` seconds for a free connection
+        self.pool = BlockingConnectionPool(minconn=1,
                                            maxconn=max_connections,
-                                           dsn="dbname={db_name} user={db_user} host={db_host} password={db_pass} port={db_port}"  # noqa: E501
-                                               .format(**db_config))
+                                           dsn=_dsn(db_config),
+                                           block=block,
+                                           timeout=pool_timeout)
+        self._stats_lock = threading.Lock()
+        self._method_timings = {}
+        # Connection pinned by `transaction()`, per thread
+        self._local = threading.local()
+        # Results of `cached_query`, only used if `cache_size` is set
+        self.cache = QueryCache(max_size=cache_size, ttl=cache_ttl) if cache_size else None
+
+    def stats(self):
+        """
+        :return: dict of the pool stats (see `BlockingConnectionPool.stats`) and
+                 the call latency (in seconds) of `insert`, `upsert` and `update` under `methods`
+        """
+        stats = self.pool.stats()
+        with self._stats_lock:
+            stats['methods'] = {name: timing.as_dict() for name, timing in self._method_timings.items()}
+        return stats
+
+    def reset_stats(self):
+        self.pool.reset_stats()
+        with self._stats_lock:
+            self._method_timings = {}
 
     @contextmanager
     def getcursor(self, **kwargs):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # Inside of `transaction()`, it will commit or rollback once it is done
+            yield conn.cursor(**kwargs)
+            return
+
         conn = self.pool.getconn()
         try:
             yield conn.cursor(**kwargs)
@@ -47,149 +642,352 @@ class Database:
         finally:
             self.pool.putconn(conn)
 
+    def fetch_columns(self, cur, batch_size=10000, as_numpy=False):
+        """
+        Fetch the rest of the results of the query that was run on `cur` as columns instead of rows
+        The rows are fetched `batch_size` at a time and added on to the columns
+
+        :param as_numpy: If `True` each column is a numpy array, numbers/dates use numeric dtypes
+                         (ints with NULLs become floats with NaN, NULL dates become NaT)
+        :return: dict of {column_name: list or numpy array}
+        """
+        # Named (server side) cursors only set `description` once the first rows are fetched
+        rows = cur.fetchmany(batch_size)
+        names = [column[0] for column in cur.description]
+        if as_numpy is True:
+            import numpy as np  # pip install numpy
+            dtypes = [_NUMPY_DTYPES.get(column[1], object) for column in cur.description]
+        columns = [[] for _ in names]
+
+        while rows:
+            for i, values in enumerate(zip(*rows)):
+                if as_numpy is True:
+                    # Keep each batch as an array so the python objects can be freed
+                    columns[i].append(_numpy_chunk(np, list(values), dtypes[i]))
+                else:
+                    columns[i].extend(values)
+            rows = cur.fetchmany(batch_size)
+
+        if as_numpy is True:
+            columns = [np.concatenate(chunks) if chunks else np.array([], dtype=dtypes[i])
+                       for i, chunks in enumerate(columns)]
+
+        return dict(zip(names, columns))
+
+    def cached_query(self, query, params=None, tables=None):
+        """
+        Run a select and return all the rows, using the cache if `cache_size` was set.
+        Cached results are removed after `cache_ttl` seconds, or when `insert`, `upsert` or `update`
+        write to a table the query reads from.
+        The cache is not used inside of `transaction()`, or when the tables can not be found in the query
+        (like when a function is called in the FROM, or there is no FROM) and `tables` is not set
+
+        :param tables: Tables the query reads from, found in the query if not set
+        :return: list of rows
+        """
+        if self.cache is not None and not self.in_transaction():
+            if tables is None:
+                tables = tables_in_query(query)
+            else:
+                tables = {normalize_table(table) for table in tables}
+
+        # Without the tables the result could never be invalidated, so it is not cached
+        if self.cache is None or self.in_transaction() or tables is None:
+            with self.getcursor() as cur:
+                cur.execute(query, params)
+                return cur.fetchall()
+        tables = sorted(tables)
+
+        key = (query, repr(params))
+        found, rows = self.cache.get(key)
+        if found:
+            return list(rows)
+
+        generation = self.cache.generation(tables)
+        with self.getcursor() as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+        self.cache.set(key, rows, tables, generation=generation)
+        return list(rows)
+
+    def _invalidate_table(self, table):
+        if self.cache is None:
+            return
+        if self.in_transaction():
+            # Wait until the transaction is committed
+            self._local.invalidate_tables.add(table)
+        else:
+            self.cache.invalidate(table)
+
+    def in_transaction(self):
+        """
+        :return: `True` if called inside of `transaction()` in this thread
+        """
+        return getattr(self._local, 'conn', None) is not None
+
+    @contextmanager
+    def transaction(self):
+        """
+        Use a single connection and transaction for every call made inside of the `with` block (in this thread)
+        Everything is committed at the end of the block, or rolled back if there is an error
+
+        Nested transactions use a savepoint so only their changes are rolled back on an error
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            savepoint = '_cutil_savepoint_{uid}'.format(uid=uuid.uuid4().hex)
+            with conn.cursor() as cur:
+                cur.execute("SAVEPOINT {savepoint}".format(savepoint=savepoint))
+            try:
+                yield self
+            except Exception:
+                with conn.cursor() as cur:
+                    cur.execute("ROLLBACK TO SAVEPOINT {savepoint}".format(savepoint=savepoint))
+                raise
+            with conn.cursor() as cur:
+                cur.execute("RELEASE SAVEPOINT {savepoint}".format(savepoint=savepoint))
+            return
+
+        conn = self.pool.getconn()
+        self._local.conn = conn
+        self._local.invalidate_tables = set()
+        try:
+            yield self
+            conn.commit()
+
+        except Exception:
+            conn.rollback()
+            raise
+
+        finally:
+            self._local.conn = None
+            self.pool.putconn(conn)
+            # Now that the changes are visible to other connections, remove the old cached results
+            for table in self._local.invalidate_tables:
+                self._invalidate_table(table)
+
     def close(self):
         self.pool.closeall()
 
-    def insert(self, table, data_list, return_cols='id'):
+    def select_stream(self, query, params=None, itersize=2000, row_type='tuple', batch=False):
+        """
+        Run a select using a server side (named) cursor and yield the rows as they are fetched,
+        only `itersize` rows are held in memory at a time
+
+        :param row_type: `tuple`, `dict` or `namedtuple`
+        :param batch: If `True` yield lists of up to `itersize` rows instead of a single row at a time
+        """
+        from psycopg2.extras import NamedTupleCursor, RealDictCursor
+
+        cursor_factories = {'tuple': None,
+                            'dict': RealDictCursor,
+                            'namedtuple': NamedTupleCursor,
+                            }
+        if row_type not in cursor_factories:
+            raise ValueError("row_type must be one of `tuple`, `dict` or `namedtuple`")
+
+        cursor_name = '_cutil_stream_{uid}'.format(uid=uuid.uuid4().hex)
+        with self.getcursor(name=cursor_name, cursor_factory=cursor_factories[row_type]) as cur:
+            cur.itersize = itersize
+            cur.execute(query, params)
+            if batch is True:
+                rows = cur.fetchmany(itersize)
+                while rows:
+                    yield rows
+                    rows = cur.fetchmany(itersize)
+            else:
+                yield from cur
+
+    def get_column_types(self, cur, table):
+        """
+        Get the postgres type name of each column in the table
+        :return: dict of {column_name: type_name}
+        """
+        cur.execute(_COLUMN_TYPES_SQL, (table,))
+        return dict(cur.fetchall())
+
+    def create_stage_table(self, cur, table, columns):
+        """
+        Create an empty temp table with the same column types as `columns` in `table`
+        The temp table is dropped when the transaction is committed
+        :return: name of the temp table
+        """
+        stage_table, query = _stage_table_sql(table, columns)
+        cur.execute(query)
+        return stage_table
+
+    def copy_rows(self, cur, table, columns, rows, copy_format='text'):
+        """
+        Stream `rows` into `table` using `COPY ... FROM STDIN`
+        Rows are encoded as they are sent, so `rows` can be a generator of any size
+
+        :return: number of rows sent
+        """
+        query = _copy_sql(table, columns, copy_format)
+        column_types = self.get_column_types(cur, table) if copy_format == 'binary' else None
+        stream = _copy_stream(columns, rows, copy_format, column_types=column_types)
+        try:
+            cur.copy_expert(query, stream)
+        except Exception:
+            if stream.error is not None:
+                # Raise the `ValueError` for a bad row instead of the `QueryCanceled` it caused
+                raise stream.error
+            raise
+        return stream.row_count
+
+    def _copy_insert(self, table, data_list, return_cols, copy_format, columns):
+        """
+        Insert using COPY. If data needs to be returned the rows are copied into a temp table first
+        and then inserted into `table` with a single `INSERT ... SELECT ... RETURNING`
+        """
+        first_row, rows = _peek_rows(data_list)
+        if first_row is None:
+            # No need to continue
+            return []
+
+        columns = _get_columns(first_row, columns)
+        return_cols = _return_cols_sql(return_cols)
+
+        try:
+            with self.getcursor() as cur:
+                if not return_cols:
+                    self.copy_rows(cur, table, columns, rows, copy_format=copy_format)
+                    return None
+
+                stage_table = self.create_stage_table(cur, table, columns)
+                self.copy_rows(cur, stage_table, columns, rows, copy_format=copy_format)
+                cur.execute(_insert_select_sql(table, columns, stage_table, return_cols))
+                return cur.fetchall()
+
+        except Exception:
+            logger.debug("Error copying data into {table}".format(table=table))
+            raise
+
+    def execute_values(self, cur, query_start, query_end, columns, rows, chunk_size=None,
+                       chunk_bytes=DEFAULT_CHUNK_BYTES, commit_chunks=False, row_template=None):
+        """
+        Run `query_start VALUES... query_end` once per batch of rows
+        Each row is mogrify'd on its own so only one batch of the query is held in memory at a time
+
+        `row_template` defaults to `(%s,%s,...)` with a `%s` for each column
+
+        :return: list of all rows returned by the queries, `None` if the queries do not return anything
+        """
+        query_start = query_start.encode('utf-8')
+        query_end = query_end.encode('utf-8')
+
+        results = None
+        for batch in _value_batches(cur.mogrify, rows, columns, row_template=row_template,
+                                    chunk_size=chunk_size, chunk_bytes=chunk_bytes):
+            cur.execute(query_start + b','.join(batch) + query_end)
+            if cur.description is not None:
+                if results is None:
+                    results = []
+                results.extend(cur.fetchall())
+            if commit_chunks is True and not self.in_transaction():
+                cur.connection.commit()
+
+        return results
+
+    @_timed
+    @_invalidates_cache
+    def insert(self, table, data_list, return_cols='id', method='values', copy_format='text', columns=None,
+               chunk_size=None, chunk_bytes=DEFAULT_CHUNK_BYTES, commit_chunks=False):
         """
         Create a bulk insert statement which is much faster (~2x in tests with 10k & 100k rows and n cols)
         for inserting data then executemany()
 
-        TODO: Is there a limit of length the query can be? If so handle it.
+        `data_list` can be any iterable (or generator) of dicts, or of tuples when `columns` is set.
+        The rows are read as is, they are never copied or changed.
+
+        With `method='copy'` the data is streamed using COPY
+
+        With `method='values'` the rows are sent in batches of at most `chunk_size` rows and `chunk_bytes` bytes
         """
-        data_list = copy.deepcopy(data_list)  # Create deepcopy so the original list does not get modified
-        # Make sure that `data_list` is a list
-        if not isinstance(data_list, list):
-            data_list = [data_list]
+        if method == 'copy':
+            return self._copy_insert(table, data_list, return_cols, copy_format, columns)
+        elif method != 'values':
+            raise ValueError("method must be either `values` or `copy`")
+
+        first_row, rows = _peek_rows(data_list)
         # Make sure data_list has content
-        if len(data_list) == 0:
+        if first_row is None:
             # No need to continue
             return []
 
-        # Data in the list must be dicts (just check the first one)
-        if not isinstance(data_list[0], dict):
-            raise ValueError("Data must be a list of dicts")
-
-        # Make sure return_cols is a list
-        if return_cols is None or len(return_cols) == 0 or return_cols[0] is None:
-            return_cols = ''
-        elif not isinstance(return_cols, list):
-            return_cols = [return_cols]
-
-        if len(return_cols) > 0:
-            return_cols = 'RETURNING ' + ','.join(return_cols)
+        # Data must be dicts, or tuples with `columns` set (just check the first one)
+        columns = _get_columns(first_row, columns)
+        query_start, query_end = _insert_sql(table, columns, _return_cols_sql(return_cols))
 
         try:
             with self.getcursor() as cur:
-                query = "INSERT INTO {table} ({fields}) VALUES {values} {return_cols}"\
-                        .format(table=table,
-                                fields='"{0}"'.format('", "'.join(data_list[0].keys())),
-                                values=','.join(['%s'] * len(data_list)),
-                                return_cols=return_cols,
-                                )
-                values = []
-                for row in [tuple(v.values()) for v in data_list]:
-                    values.append(_check_values(row))
-
-                query = cur.mogrify(query, values)
-                cur.execute(query)
-
-                try:
-                    return cur.fetchall()
-                except Exception:
-                    return None
+                return self.execute_values(cur, query_start, query_end, columns, rows,
+                                           chunk_size=chunk_size,
+                                           chunk_bytes=chunk_bytes,
+                                           commit_chunks=commit_chunks)
 
         except Exception:
-            logger.debug("Error inserting data: {data}".format(data=data_list))
+            logger.debug("Error inserting data into {table}".format(table=table))
             raise
 
+    @_timed
+    @_invalidates_cache
     def upsert(self, table, data_list, on_conflict_fields, on_conflict_action='update',
-               on_conflict_where=None, update_fields=None, return_cols='id'):
+               on_conflict_where=None, update_fields=None, return_cols='id', columns=None,
+               chunk_size=None, chunk_bytes=DEFAULT_CHUNK_BYTES, commit_chunks=False,
+               method='values', copy_format='text'):
         """
         Create a bulk upsert statement which is much faster (~6x in tests with 10k & 100k rows and n cols)
         for upserting data then executemany()
 
-        TODO: Is there a limit of length the query can be? If so handle it.
+        With `method='values'` the rows are sent in batches of at most `chunk_size` rows and `chunk_bytes` bytes
+
+        With `method='staging'` the rows are streamed into a temp table using COPY and merged into `table`
+        with a single query, rows with duplicate `on_conflict_fields` are removed (last one wins)
         """
-        data_list = copy.deepcopy(data_list)  # Create deepcopy so the original list does not get modified
-        # Make sure that `data_list` is a list
-        if not isinstance(data_list, list):
-            data_list = [data_list]
+        if method not in ('values', 'staging'):
+            raise ValueError("method must be either `values` or `staging`")
+
+        first_row, rows = _peek_rows(data_list)
         # Make sure data_list has content
-        if len(data_list) == 0:
+        if first_row is None:
             # No need to continue
             return []
-        # Data in the list must be dicts (just check the first one)
-        if not isinstance(data_list[0], dict):
-            raise ValueError("Data must be a list of dicts")
-
-        # Make sure on_conflict_fields is a list
-        if not isinstance(on_conflict_fields, list):
-            on_conflict_fields = [on_conflict_fields]
-        # Make sure on_conflict_fields has data
-        if len(on_conflict_fields) == 0 or on_conflict_fields[0] is None:
-            # No need to continue
-            raise ValueError("Must pass in `on_conflict_fields` argument")
+        # Data must be dicts, or tuples with `columns` set (just check the first one)
+        columns = _get_columns(first_row, columns)
 
-        # Support for partial index on table
-        if on_conflict_where:
-            on_conflict_where = f'WHERE {on_conflict_where}'
-        else:
-            on_conflict_where = ''
-
-        # Make sure return_cols is a list
-        if return_cols is None or len(return_cols) == 0 or return_cols[0] is None:
-            return_cols = ''
-        elif not isinstance(return_cols, list):
-            return_cols = [return_cols]
-
-        if len(return_cols) > 0:
-            return_cols = 'RETURNING ' + ','.join(return_cols)
-
-        # Make sure update_fields is a list/valid
-        if on_conflict_action == 'update':
-            if not isinstance(update_fields, list):
-                update_fields = [update_fields]
-            # If noting is passed in, set `update_fields` to all (data_list-on_conflict_fields)
-            if len(update_fields) == 0 or update_fields[0] is None:
-                update_fields = list(set(data_list[0].keys()) - set(on_conflict_fields))
-                # If update_fields is empty here that could only mean that all fields are set as conflict_fields
-                if len(update_fields) == 0:
-                    raise ValueError("Not all the fields can be `on_conflict_fields` when doing an update")
-
-            # If everything is good to go with the update fields
-            fields_update_tmp = []
-            for key in update_fields:
-                fields_update_tmp.append('"{0}"="excluded"."{0}"'.format(key))
-            conflict_action_sql = 'UPDATE SET {update_fields}'\
-                                  .format(update_fields=', '.join(fields_update_tmp))
-        else:
-            # Do nothing on conflict
-            conflict_action_sql = 'NOTHING'
+        on_conflict_fields, conflict_sql = _upsert_sql(columns, on_conflict_fields, on_conflict_action,
+                                                       on_conflict_where, update_fields,
+                                                       _return_cols_sql(return_cols))
+
+        if method == 'staging':
+            return self._staging_upsert(table, rows, columns, on_conflict_fields, conflict_sql, copy_format)
+
+        try:
+            with self.getcursor() as cur:
+                query_start, _ = _insert_sql(table, columns, '')
+                return self.execute_values(cur, query_start, conflict_sql, columns, rows,
+                                           chunk_size=chunk_size,
+                                           chunk_bytes=chunk_bytes,
+                                           commit_chunks=commit_chunks)
+
+        except Exception:
+            logger.debug("Error upserting data into {table}".format(table=table))
+            raise
 
+    def _staging_upsert(self, table, rows, columns, on_conflict_fields, conflict_sql, copy_format):
+        """
+        COPY the rows into a temp table, then merge them into `table` with a single `INSERT ... SELECT`
+        Rows with the same `on_conflict_fields` are de-duplicated, the last one in the data is kept
+        (even with `on_conflict_action='nothing'`, where the `values` method keeps the first).
+        Rows with a NULL in any of the `on_conflict_fields` are not de-duplicated.
+        """
         try:
             with self.getcursor() as cur:
-                query = """INSERT INTO {table} ({insert_fields})
-                           VALUES {values}
-                           ON CONFLICT ({on_conflict_fields}) {on_conflict_where} DO
-                           {conflict_action_sql}
-                           {return_cols}
-                        """.format(table=table,
-                                   insert_fields='"{0}"'.format('","'.join(data_list[0].keys())),
-                                   values=','.join(['%s'] * len(data_list)),
-                                   on_conflict_fields=','.join(on_conflict_fields),
-                                   on_conflict_where=on_conflict_where,
-                                   conflict_action_sql=conflict_action_sql,
-                                   return_cols=return_cols,
-                                   )
-                # Get all the values for each row and create a lists of lists
-                values = []
-                for row in [list(v.values()) for v in data_list]:
-                    values.append(_check_values(row))
-
-                query = cur.mogrify(query, values)
-
-                cur.execute(query)
+                stage_table = self.create_stage_table(cur, table, columns)
+                cur.execute(_STAGE_ROW_NUM_SQL.format(stage_table=stage_table))
+                self.copy_rows(cur, stage_table, columns, rows, copy_format=copy_format)
+                cur.execute(_staging_upsert_sql(table, columns, on_conflict_fields, stage_table, conflict_sql))
 
                 try:
                     return cur.fetchall()
@@ -197,72 +995,76 @@ class Database:
                     return None
 
         except Exception:
-            logger.debug("Error upserting data: {data}".format(data=data_list))
+            logger.debug("Error upserting data into {table} using a staging table".format(table=table))
             raise
 
-    def update(self, table, data_list, matched_field=None, return_cols='id'):
+    def _bulk_update(self, table, rows, matched_field, return_cols, columns, chunk_size, chunk_bytes, commit_chunks):
         """
-        Create a bulk insert statement which is much faster (~2x in tests with 10k & 100k rows and 4 cols)
-        for inserting data then executemany()
+        Update all rows with a single set based `UPDATE ... FROM (VALUES ...)` query per chunk
+        """
+        try:
+            with self.getcursor() as cur:
+                column_types = self.get_column_types(cur, table)
+                value_columns, query_start, query_end, row_template = _bulk_update_sql(table, columns, matched_field,
+                                                                                       column_types, return_cols)
+                results = self.execute_values(cur, query_start, query_end, value_columns,
+                                              _bulk_update_rows(rows, columns, matched_field),
+                                              chunk_size=chunk_size,
+                                              chunk_bytes=chunk_bytes,
+                                              commit_chunks=commit_chunks,
+                                              row_template=row_template)
+                if results is None and return_cols:
+                    # No rows had a matched value to update with
+                    return []
+                return results
+
+        except Exception:
+            logger.debug("Error bulk updating data in {table}".format(table=table))
+            raise
+
+    @_timed
+    @_invalidates_cache
+    def update(self, table, data_list, matched_field=None, return_cols='id', columns=None, method='each',
+               chunk_size=None, chunk_bytes=DEFAULT_CHUNK_BYTES, commit_chunks=False):
+        """
+        Update rows matched on `matched_field`
 
-        TODO: Is there a limit of length the query can be? If so handle it.
+        With `method='each'` an `UPDATE` statement is created for each row, rows can have different keys.
+
+        With `method='bulk'` all rows are sent as a single `UPDATE ... FROM (VALUES ...)` per chunk
+        (at most `chunk_size` rows and `chunk_bytes` bytes). All rows must have the same keys,
+        a `ValueError` is raised for a row with different keys.
+        The rows returned are the rows updated in the database.
         """
-        data_list = copy.deepcopy(data_list)  # Create deepcopy so the original list does not get modified
+        if method not in ('each', 'bulk'):
+            raise ValueError("method must be either `each` or `bulk`")
+
         if matched_field is None:
             # Assume the id field
             logger.info("Matched field not defined, assuming the `id` field")
             matched_field = 'id'
 
-        # Make sure that `data_list` is a list
-        if not isinstance(data_list, list):
-            data_list = [data_list]
-
-        if len(data_list) == 0:
+        first_row, rows = _peek_rows(data_list)
+        if first_row is None:
             # No need to continue
             return []
 
-        # Make sure return_cols is a list
-        if return_cols is None or len(return_cols) == 0 or return_cols[0] is None:
-            return_cols = ''
-        elif not isinstance(return_cols, list):
-            return_cols = [return_cols]
+        return_cols = _return_cols_sql(return_cols)
 
-        if len(return_cols) > 0:
-            return_cols = 'RETURNING ' + ','.join(return_cols)
+        # Data must be dicts, or tuples with `columns` set (just check the first one)
+        columns = _get_columns(first_row, columns)
 
-        # Data in the list must be dicts (just check the first one)
-        if not isinstance(data_list[0], dict):
-            raise ValueError("Data must be a list of dicts")
+        if method == 'bulk':
+            return self._bulk_update(table, rows, matched_field, return_cols, columns,
+                                     chunk_size, chunk_bytes, commit_chunks)
 
         try:
             with self.getcursor() as cur:
-                query_list = []
-                # TODO: change to return data from the database, not just what you passed in
-                return_list = []
-                for row in data_list:
-                    if row.get(matched_field) is None:
-                        logger.debug("Cannot update row. Missing field {field} in data {data}"
-                                     .format(field=matched_field, data=row))
-                        logger.error("Cannot update row. Missing field {field} in data".format(field=matched_field))
-                        continue
-
-                    # Pull matched_value from data to be updated and remove that key
-                    matched_value = row.get(matched_field)
-                    del row[matched_field]
-
-                    query = "UPDATE {table} SET {data} WHERE {matched_field}=%s {return_cols}"\
-                            .format(table=table,
-                                    data=','.join("%s=%%s" % u for u in row.keys()),
-                                    matched_field=matched_field,
-                                    return_cols=return_cols
-                                    )
-                    values = list(row.values())
-                    values.append(matched_value)
-                    values = _check_values(values)
-
-                    query = cur.mogrify(query, values)
-                    query_list.append(query)
-                    return_list.append(matched_value)
+                query_list = [cur.mogrify(query, values)
+                              for query, values in _update_statements(table, rows, columns, matched_field,
+                                                                      return_cols)]
+                if not query_list:
+                    return []
 
                 finial_query = b';'.join(query_list)
                 cur.execute(finial_query)
@@ -273,5 +1075,103 @@ class Database:
                     return None
 
         except Exception:
-            logger.debug("Error updating data: {data}".format(data=data_list))
+            logger.debug("Error updating data in {table}".format(table=table))
             raise
+
+    def parallel_load(self, table, data_list, operation='insert', num_workers=None, partition_size=None,
+                      retries=2, retry_delay=1.0, **kwargs):
+        """
+        Split the data into partitions and write them at the same time using separate connections from the pool
+        Each partition is written (and committed) on its own with `insert` or `upsert`, so the load is not atomic
+
+        A list is split into `num_workers` partitions (or partitions of `partition_size` rows if set),
+        any other iterable is read `partition_size` (default 10000) rows at a time
+
+        :return: dict with a summary of the load:
+                 `rows` written, number of `partitions`, `retries` done, `errors` as a list of
+                 (partition_index, exception) for partitions that failed after all retries,
+                 `results` of all partitions combined and `duration` in seconds.
+                 `results` are in the order the partitions finished, not in the order of `data_list`
+        """
+        from cutil import chunks_of, split_into
+
+        if operation not in ('insert', 'upsert'):
+            raise ValueError("operation must be either `insert` or `upsert`")
+        write_func = getattr(self, operation)
+
+        # Each worker needs its own connection
+        if num_workers is None or num_workers > self.pool.maxconn:
+            num_workers = self.pool.maxconn
+
+        summary = {'rows': 0,
+                   'partitions': 0,
+                   'retries': 0,
+                   'errors': [],
+                   'results': None,
+                   'duration': 0.0,
+                   }
+
+        if isinstance(data_list, dict):
+            # A single row, the same as `insert`/`upsert`
+            data_list = [data_list]
+
+        if isinstance(data_list, list):
+            if not data_list:
+                # No need to continue
+                return summary
+            if partition_size is None:
+                partitions = split_into(num_workers, data_list)
+            else:
+                partitions = chunks_of(partition_size, data_list)
+        else:
+            rows = iter(data_list)
+            partition_size = partition_size or 10000
+            partitions = iter(lambda: list(itertools.islice(rows, partition_size)), [])
+
+        def _load_partition(partition_index, partition):
+            for try_num in range(retries + 1):
+                try:
+                    return write_func(table, partition, **kwargs)
+                except Exception:
+                    if try_num >= retries:
+                        raise
+                    logger.warning("Error loading partition {index} into {table}, retrying"
+                                   .format(index=partition_index, table=table), exc_info=True)
+                    with summary_lock:
+                        summary['retries'] += 1
+                    time.sleep(retry_delay)
+
+        def _done(partition_index, partition, future):
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.exception("Failed to load partition {index} into {table}"
+                                 .format(index=partition_index, table=table))
+                summary['errors'].append((partition_index, e))
+                return
+            summary['rows'] += len(partition)
+            if result is not None:
+                if summary['results'] is None:
+                    summary['results'] = []
+                summary['results'].extend(result)
+
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        summary_lock = threading.Lock()
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            # Only read a few partitions ahead of the workers so a generator is not loaded into memory
+            running = {}
+            for partition_index, partition in enumerate(partitions):
+                summary['partitions'] += 1
+                running[executor.submit(_load_partition, partition_index, partition)] = (partition_index, partition)
+                if len(running) >= num_workers * 2:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        _done(*running.pop(future), future)
+
+            for future in wait(running).done:
+                _done(*running.pop(future), future)
+
+        summary['duration'] = time.perf_counter() - start_time
+        return summary
@@ -0,0 +1,115 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Timing:
+    """ Running count/total/max of a duration """
+
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def as_dict(self):
+        return {'count': self.count,
+                'total': self.total,
+                'avg': self.total / self.count if self.count else 0.0,
+                'max': self.max,
+                }
+
+
+class BlockingConnectionPool:
+    """
+    Wraps psycopg2's `ThreadedConnectionPool` so `getconn` waits for a free connection instead of
+    raising `PoolError` right away, and keeps track of how the pool is being used.
+
+    :param block: If `True` wait up to `timeout` seconds (forever if `None`) for a connection to be free.
+                  If `False` raise `PoolError` right away when all connections are in use.
+    """
+
+    def __init__(self, minconn, maxconn, dsn, block=False, timeout=None):
+        from psycopg2.pool import ThreadedConnectionPool
+
+        self.maxconn = maxconn
+        self.block = block
+        self.timeout = timeout
+        self._pool = ThreadedConnectionPool(minconn=minconn, maxconn=maxconn, dsn=dsn)
+        self._available = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._checked_out = {}  # id(conn): time it was checked out
+
+        self._wait = _Timing()
+        self._hold = _Timing()
+        self._timeouts = 0
+
+    def getconn(self):
+        from psycopg2.pool import PoolError
+
+        start_time = time.perf_counter()
+        if self.block is True:
+            acquired = self._available.acquire(timeout=self.timeout)
+        else:
+            acquired = self._available.acquire(blocking=False)
+        checkout_time = time.perf_counter()
+
+        if not acquired:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolError("connection pool exhausted, waited {wait:.3f}s"
+                            .format(wait=checkout_time - start_time))
+
+        try:
+            conn = self._pool.getconn()
+        except Exception:
+            self._available.release()
+            raise
+
+        with self._lock:
+            self._wait.add(checkout_time - start_time)
+            self._checked_out[id(conn)] = checkout_time
+        return conn
+
+    def putconn(self, conn, close=False):
+        with self._lock:
+            checkout_time = self._checked_out.pop(id(conn), None)
+            if checkout_time is not None:
+                self._hold.add(time.perf_counter() - checkout_time)
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._available.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+    def stats(self):
+        """
+        :return: dict of the current state of the pool and the checkout wait/hold times in seconds
+        """
+        with self._lock:
+            in_use = len(self._checked_out)
+            return {'max_connections': self.maxconn,
+                    'in_use': in_use,
+                    # Connections that are open but not checked out
+                    'idle': len(self._pool._pool),
+                    'timeouts': self._timeouts,
+                    'wait': self._wait.as_dict(),
+                    'hold': self._hold.as_dict(),
+                    }
+
+    def reset_stats(self):
+        with self._lock:
+            self._wait = _Timing()
+            self._hold = _Timing()
+            self._timeouts = 0
@@ -0,0 +1,332 @@
+import math
+import time
+import inspect
+import logging
+import threading
+import contextvars
+from functools import wraps
+
+from cutil.repeating_timer import RepeatingTimer
+
+logger = logging.getLogger(__name__)
+
+# Start times of the `with timer:` blocks that are running in this thread/task, as a tuple of (timer, start time).
+# Each asyncio task gets its own copy, so coroutines using the same timer do not see each others start times
+_timer_starts = contextvars.ContextVar('cutil_timer_starts', default=())
+
+# Bucket width of the histograms, percentiles are within ~1% of the real value
+_GAMMA = 1.02
+_LOG_GAMMA = math.log(_GAMMA)
+
+
+class Histogram:
+    """
+    Streaming histogram with log sized buckets, keeps a fixed amount of memory no matter
+    how many values are added and can give any percentile within ~1% of the real value.
+    Values <= 0 are kept in their own bucket.
+
+    Not thread safe, `MetricsRegistry` gives each thread its own histograms.
+    """
+
+    __slots__ = ('count', 'total', 'min', 'max', '_buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        key = math.ceil(math.log(value) / _LOG_GAMMA) if value > 0 else None
+        self._buckets[key] = self._buckets.get(key, 0) + 1
+
+    def merge(self, other):
+        """
+        Add the values of another histogram to this one
+        """
+        if not other.count:
+            return
+        self.count += other.count
+        self.total += other.total
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        for key, count in other._buckets.items():
+            self._buckets[key] = self._buckets.get(key, 0) + count
+
+    def percentile(self, percent):
+        """
+        :param percent: 0-100
+        :return: estimated value, `None` if there are no values
+        """
+        if not self.count:
+            return None
+
+        target = percent / 100.0 * self.count
+        seen = 0
+        # The bucket of values <= 0 comes first
+        for key in sorted(self._buckets, key=lambda k: -math.inf if k is None else k):
+            seen += self._buckets[key]
+            if seen >= target:
+                break
+
+        if key is None:
+            return self.min
+        # Middle of the bucket, which covers (gamma^(key-1), gamma^key]
+        value = 2 * _GAMMA ** key / (_GAMMA + 1)
+        return min(max(value, self.min), self.max)
+
+    def as_dict(self, percentiles=(50, 90, 99)):
+        stats = {'count': self.count,
+                 'total': self.total,
+                 'avg': self.total / self.count if self.count else 0.0,
+                 'min': self.min,
+                 'max': self.max,
+                 }
+        for percent in percentiles:
+            stats['p{percent}'.format(percent=percent)] = self.percentile(percent)
+        return stats
+
+
+class _Shard:
+    """ Metrics recorded by a single thread """
+
+    __slots__ = ('thread', 'lock', 'counters', 'histograms')
+
+    def __init__(self, thread):
+        self.thread = thread
+        # Only contended while the registry is reading this shard
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def merge(self, other):
+        for name, value in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        for name, histogram in other.histograms.items():
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].merge(histogram)
+
+
+class _Timer:
+    """ Context manager and decorator that records how long something took """
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        # The same timer can be used by many threads and coroutines at once
+        _timer_starts.set(_timer_starts.get() + ((self, time.perf_counter()),))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end_time = time.perf_counter()
+        starts = _timer_starts.get()
+        # Latest start of this timer, other timers may have been entered inside of it and not exited yet
+        index = max(i for i, (timer, _) in enumerate(starts) if timer is self)
+        start_time = starts[index][1]
+        _timer_starts.set(starts[:index] + starts[index + 1:])
+        self.registry.record_time(self.name, end_time - start_time, failed=exc_type is not None)
+
+    def __call__(self, func):
+        registry = self.registry
+        name = self.name
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start_time = time.perf_counter()
+                failed = True
+                try:
+                    result = await func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    registry.record_time(name, time.perf_counter() - start_time, failed=failed)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                registry.record_time(name, time.perf_counter() - start_time, failed=failed)
+        return wrapper
+
+
+def log_sink(snapshot):
+    """
+    Default sink, logs each metric in the snapshot
+    """
+    for name, value in sorted(snapshot['counters'].items()):
+        logger.info("{name}: {value}".format(name=name, value=value))
+    for name, stats in sorted(snapshot['histograms'].items()):
+        logger.info("{name}: {stats}".format(name=name, stats=stats))
+
+
+class MetricsRegistry:
+    """
+    Collect counters and histograms in process and send them to a `sink` in one batch every `flush_interval` seconds
+
+    Each thread records into its own shard, so threads do not wait on each other to record a value.
+    The shards are merged when a snapshot is taken.
+
+    :param sink: Function called with the snapshot on every flush, defaults to logging it
+    :param flush_interval: Seconds between flushes, `None` to only flush when `flush()` is called.
+                           The flush timer is started when the first value is recorded
+    :param percentiles: Percentiles included for each histogram in the snapshot
+    """
+
+    def __init__(self, sink=None, flush_interval=None, percentiles=(50, 90, 99)):
+        self.sink = sink or log_sink
+        self.flush_interval = flush_interval
+        self.percentiles = percentiles
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        # Metrics of threads that are done
+        self._retired = _Shard(None)
+
+        self._timer = None
+        self._timer_started = False
+        if flush_interval:
+            self._timer = RepeatingTimer(flush_interval, self._flush_on_timer, daemon=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+                if self._timer is not None and self._timer_started is False:
+                    # Not started until it is used, so a registry that is never used does not start a thread
+                    self._timer_started = True
+                    self._timer.start()
+        return shard
+
+    def incr(self, name, value=1):
+        """
+        Add `value` to the counter `name`
+        """
+        shard = self._shard()
+        with shard.lock:
+            shard.counters[name] = shard.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """
+        Add `value` to the histogram `name`
+        """
+        shard = self._shard()
+        with shard.lock:
+            histogram = shard.histograms.get(name)
+            if histogram is None:
+                histogram = shard.histograms[name] = Histogram()
+            histogram.add(value)
+
+    def record_time(self, name, seconds, failed=False):
+        """
+        Add `seconds` to the histogram `name`, and count it in the counter `<name>.errors` if it failed
+        """
+        shard = self._shard()
+        with shard.lock:
+            histogram = shard.histograms.get(name)
+            if histogram is None:
+                histogram = shard.histograms[name] = Histogram()
+            histogram.add(seconds)
+            if failed is True:
+                error_name = name + '.errors'
+                shard.counters[error_name] = shard.counters.get(error_name, 0) + 1
+
+    def timer(self, name):
+        """
+        Time a block of code or a function (normal or async) into the histogram `name`
+
+            with registry.timer('load'):
+                ...
+
+            @registry.timer('fetch')
+            async def fetch(url):
+                ...
+        """
+        return _Timer(self, name)
+
+    def snapshot(self, reset=False):
+        """
+        :param reset: Clear the metrics after reading them
+        :return: dict of {'counters': {name: value}, 'histograms': {name: stats}}
+        """
+        total = _Shard(None)
+        with self._lock:
+            live_shards = []
+            for shard in self._shards:
+                if shard.thread.is_alive():
+                    live_shards.append(shard)
+                else:
+                    # The thread is done and will not record anything else, keep what it recorded in
+                    # one shard so the list does not grow with every thread that was ever used
+                    self._retired.merge(shard)
+            self._shards = live_shards
+
+            for shard in live_shards + [self._retired]:
+                with shard.lock:
+                    total.merge(shard)
+                    if reset is True:
+                        shard.counters = {}
+                        shard.histograms = {}
+
+        return {'counters': total.counters,
+                'histograms': {name: histogram.as_dict(self.percentiles)
+                               for name, histogram in total.histograms.items()},
+                }
+
+    def flush(self):
+        """
+        Send the metrics recorded since the last flush to the sink
+        :return: the snapshot that was sent
+        """
+        snapshot = self.snapshot(reset=True)
+        if snapshot['counters'] or snapshot['histograms']:
+            self.sink(snapshot)
+        return snapshot
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Error flushing metrics")
+
+    def close(self):
+        """
+        Stop the flush timer and flush what is left
+        """
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+
+
+# Used by `timeit` when no registry is passed in, logs the metrics every minute
+default_registry = MetricsRegistry(flush_interval=60)
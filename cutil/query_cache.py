@@ -0,0 +1,236 @@
+import re
+import time
+import threading
+import collections
+
+# Whitespace, comments and strings are dropped, quoted names are kept as one token
+_token_pattern = re.compile(r"""
+    (?P<skip>\s+|--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'|\$(?P<tag>[A-Za-z_]*)\$.*?\$(?P=tag)\$)
+  | (?P<name>"(?:[^"]|"")+"|[A-Za-z_][\w$]*)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+# Functions that use FROM in their arguments, like `EXTRACT(year FROM created)`
+_from_functions = {'EXTRACT', 'SUBSTRING', 'TRIM', 'OVERLAY'}
+_subquery_starts = {'SELECT', 'WITH', 'VALUES', 'TABLE'}
+_join_words = {'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'FULL', 'CROSS', 'NATURAL'}
+# Words that end the FROM list
+_clause_words = {'WHERE', 'GROUP', 'HAVING', 'WINDOW', 'ORDER', 'LIMIT', 'OFFSET', 'FETCH', 'FOR', 'UNION',
+                 'INTERSECT', 'EXCEPT', 'RETURNING', 'ON', 'USING'}
+# Words that can come after a table in the FROM list, so are not an alias
+_not_alias = _join_words | _clause_words | {'TABLESAMPLE', 'AS'}
+
+
+def _tokenize(query):
+    return [match.group() for match in _token_pattern.finditer(query) if match.lastgroup != 'skip']
+
+
+def _is_name(token):
+    return token[0] == '"' or token[0].isalpha() or token[0] == '_'
+
+
+def _close_paren(tokens, i):
+    """ :return: index after the `)` matching the `(` at `i` """
+    depth = 0
+    while i < len(tokens):
+        if tokens[i] == '(':
+            depth += 1
+        elif tokens[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+
+def _read_from_list(tokens, i):
+    """
+    Read the tables after a FROM starting at `i`, both the comma separated ones and the joined ones.
+    Subqueries are skipped here, their own FROMs are found by `tables_in_query`
+    :return: list of table names, `None` if the tables can not be known, like when a function is called
+    """
+    tables = []
+    while i < len(tokens):
+        while i < len(tokens) and tokens[i].upper() in ('LATERAL', 'ONLY'):
+            i += 1
+        if i >= len(tokens):
+            break
+
+        if tokens[i] == '(':
+            if i + 1 < len(tokens) and tokens[i + 1].upper() not in _subquery_starts:
+                # Joins in brackets, `FROM (a JOIN b ON ...)`
+                inner = _read_from_list(tokens, i + 1)
+                if inner is None:
+                    return None
+                tables.extend(inner)
+            i = _close_paren(tokens, i)
+        elif _is_name(tokens[i]):
+            name = tokens[i]
+            i += 1
+            while i + 1 < len(tokens) and tokens[i] == '.' and _is_name(tokens[i + 1]):
+                name += '.' + tokens[i + 1]
+                i += 2
+            if i < len(tokens) and tokens[i] == '(':
+                # Set returning function, it could read from any table
+                return None
+            tables.append(name)
+            if i < len(tokens) and tokens[i] == '*':
+                i += 1
+        else:
+            break
+
+        # Alias, with optional column names
+        if i < len(tokens) and tokens[i].upper() == 'AS':
+            i += 2
+        elif i < len(tokens) and _is_name(tokens[i]) and tokens[i].upper() not in _not_alias:
+            i += 1
+        if i < len(tokens) and tokens[i] == '(':
+            i = _close_paren(tokens, i)
+        if i < len(tokens) and tokens[i].upper() == 'TABLESAMPLE':
+            i = _close_paren(tokens, i + 2)
+            if i < len(tokens) and tokens[i].upper() == 'REPEATABLE':
+                i = _close_paren(tokens, i + 1)
+
+        if i < len(tokens) and tokens[i].upper() == 'ON':
+            # Skip the join condition, subqueries in it are found by `tables_in_query`
+            i += 1
+            while (i < len(tokens) and tokens[i] not in (',', ')', ';')
+                   and tokens[i].upper() not in _join_words | _clause_words):
+                i = _close_paren(tokens, i) if tokens[i] == '(' else i + 1
+        elif i < len(tokens) and tokens[i].upper() == 'USING':
+            i = _close_paren(tokens, i + 1)
+
+        if i < len(tokens) and tokens[i] == ',':
+            i += 1
+            continue
+        if i < len(tokens) and tokens[i].upper() in _join_words:
+            while i < len(tokens) and tokens[i].upper() in _join_words:
+                i += 1
+            continue
+        break
+    return tables
+
+
+def normalize_table(table):
+    """
+    Name used to match reads and writes of a table, schema and quotes are removed so
+    `schema.table`, `"table"` and `table` are all treated as the same table
+    """
+    return table.split('.')[-1].strip().strip('"').lower()
+
+
+def tables_in_query(query):
+    """
+    Find the tables a query reads from, including every table of a `FROM a, b` list and the joined tables
+    :return: set of normalized table names, `None` if they can not be found reliably,
+             like when a function is called in the FROM or there is no FROM
+    """
+    tokens = _tokenize(query)
+    tables = set()
+    parens = []  # Index of each open bracket
+    for i, token in enumerate(tokens):
+        if token == '(':
+            parens.append(i)
+        elif token == ')':
+            if parens:
+                parens.pop()
+        elif token.upper() == 'FROM':
+            if i > 0 and tokens[i - 1].upper() == 'DISTINCT':
+                # `IS DISTINCT FROM`
+                continue
+            if parens and parens[-1] > 0 and tokens[parens[-1] - 1].upper() in _from_functions:
+                continue
+            found = _read_from_list(tokens, i + 1)
+            if found is None:
+                return None
+            tables.update(normalize_table(table) for table in found)
+    # Like `SELECT nextval('s')` or `SELECT my_func(1)`, nothing could ever invalidate the result
+    return tables or None
+
+
+class QueryCache:
+    """
+    Thread safe LRU cache of query results that can be invalidated by table
+
+    :param max_size: Max number of results to keep, the least recently used are removed first
+    :param ttl: Seconds a result is kept for, `None` to keep until it is removed or invalidated
+    """
+
+    def __init__(self, max_size=1000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key: (expires_at, tables, value)
+        self._table_keys = collections.defaultdict(set)
+        # Bumped on every invalidation, so results read during a write are not cached
+        self._generations = collections.defaultdict(int)
+        self._clear_count = 0
+
+    def get(self, key):
+        """
+        :return: tuple of (found, value)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, tables, value = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                self._remove(key)
+            self.misses += 1
+            return False, None
+
+    def generation(self, tables):
+        """
+        Get the current state of the tables, pass it to `set` so the value is only cached if
+        none of the tables were changed in the mean time
+        """
+        with self._lock:
+            return self._generation(tables)
+
+    def _generation(self, tables):
+        return (self._clear_count,) + tuple(self._generations[table] for table in tables)
+
+    def set(self, key, value, tables, generation=None):
+        tables = tuple(tables)
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            if generation is not None and generation != self._generation(tables):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, tables, value)
+            for table in tables:
+                self._table_keys[table].add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, tables, _ = self._entries.pop(key)
+        for table in tables:
+            keys = self._table_keys.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._table_keys[table]
+
+    def invalidate(self, table):
+        """
+        Remove all results that read from `table`
+        """
+        table = normalize_table(table)
+        with self._lock:
+            self._generations[table] += 1
+            for key in list(self._table_keys.get(table, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._clear_count += 1
+            self._entries.clear()
+            self._table_keys.clear()
@@ -0,0 +1,174 @@
+import os
+import time
+import mmap
+import struct
+import asyncio
+import tempfile
+import inspect
+import threading
+from functools import wraps
+
+
+class RateLimiter:
+    """
+    Thread safe token bucket, allows `rate` calls every `per` seconds with bursts of up to `burst` calls
+
+    Each call reserves the next free slot while holding the lock and then sleeps outside of it,
+    so callers only wait on each other for as long as it takes to do the math, not for the whole sleep.
+
+    Can be used as a decorator on normal and async functions, or by calling `wait()`/`wait_async()`
+    before doing the thing that needs to be limited.
+    """
+
+    def __init__(self, rate, per=1.0, burst=1):
+        if rate <= 0:
+            raise ValueError("rate must be > 0")
+        if burst < 1:
+            raise ValueError("burst must be >= 1")
+
+        self.rate = rate
+        self.per = per
+        self.burst = burst
+        self.interval = abs(per) / float(rate)
+
+        self._lock = threading.Lock()
+        # Time the bucket will be full again, every call pushes it back by `interval`
+        self._full_at = 0.0
+
+        self.calls = 0
+        self.throttled_calls = 0
+        self.throttled_time = 0.0
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                await self.wait_async()
+                return await func(*args, **kwargs)
+            async_wrapper.limiter = self
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            self.wait()
+            return func(*args, **kwargs)
+        wrapper.limiter = self
+        return wrapper
+
+    def _clock(self):
+        return time.monotonic()
+
+    def _take_slot(self, now):
+        """ Push back the time the bucket is full by one call
+        :return: time the bucket was full at before this call
+        """
+        full_at = max(self._full_at, now)
+        self._full_at = full_at + self.interval
+        return full_at
+
+    def reserve(self):
+        """
+        Take the next free slot
+        :return: seconds to wait before the slot can be used
+        """
+        now = self._clock()
+        with self._lock:
+            full_at = self._take_slot(now)
+            delay = full_at - (self.burst - 1) * self.interval - now
+
+            self.calls += 1
+            if delay <= 0:
+                return 0.0
+            self.throttled_calls += 1
+            self.throttled_time += delay
+            return delay
+
+    def wait(self):
+        """
+        Block until a call is allowed
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        """
+        Same as `wait` without blocking the event loop
+        """
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        """
+        :return: dict of the number of calls, how many had to wait and the total seconds spent waiting
+        """
+        with self._lock:
+            return {'calls': self.calls,
+                    'throttled_calls': self.throttled_calls,
+                    'throttled_time': self.throttled_time,
+                    }
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = 0
+            self.throttled_calls = 0
+            self.throttled_time = 0.0
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    `RateLimiter` that shares its limit with every process of the same user on the host using the same `name`
+
+    The state is a single timestamp in a memory mapped file that is locked with `fcntl.flock`
+    while a slot is reserved, so each call only costs a lock/unlock of the file.
+    Every process should use the same `rate`, `per` and `burst`. Only works on POSIX systems.
+
+    :param name: Name of the shared limit, the state is kept in `<tempdir>/cutil-rate-limit-<uid>-<name>`.
+                 Can also be the full path of the file to use, it must not be a symlink.
+    """
+
+    def __init__(self, name, rate, per=1.0, burst=1):
+        super().__init__(rate, per=per, burst=burst)
+        if os.sep in name:
+            self.path = name
+        else:
+            self.path = os.path.join(tempfile.gettempdir(),
+                                     'cutil-rate-limit-{uid}-{name}'.format(uid=os.getuid(), name=name))
+        self._pid = None
+        self._fd = None
+        self._state = None
+
+    def _clock(self):
+        # Wall clock time so all processes compare the same values
+        return time.time()
+
+    def _open(self):
+        # The default path is in a shared dir, do not follow a symlink someone else put there
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        if os.fstat(fd).st_size < 8:
+            os.ftruncate(fd, 8)
+        self._state = mmap.mmap(fd, 8)
+        self._fd = fd
+        self._pid = os.getpid()
+
+    def _take_slot(self, now):
+        import fcntl
+
+        # File locks are per open file, so a forked process needs its own
+        if self._pid != os.getpid():
+            self._open()
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            full_at = max(struct.unpack('d', self._state[:8])[0], now)
+            self._state[:8] = struct.pack('d', full_at + self.interval)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return full_at
+
+    def close(self):
+        if self._pid == os.getpid():
+            self._state.close()
+            os.close(self._fd)
+        self._pid = None
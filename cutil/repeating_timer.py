@@ -1,9 +1,169 @@
-from threading import Timer
+import math
+import time
+import heapq
+import logging
+import threading
+import itertools
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+# Seconds a scheduler thread waits without running a job before it stops, when another thread is also waiting
+_spare_thread_timeout = 10.0
+
+
+class _Job:
+    __slots__ = ('func', 'pending', 'cancelled')
+
+    def __init__(self, func):
+        self.func = func
+        self.pending = True  # Still in the heap
+        self.cancelled = False
+
+
+class Scheduler:
+    """
+    Run functions at a set time from a small number of threads, using a heap ordered by run time.
+
+    The threads are only running while there are jobs scheduled, so a scheduler with `daemon=False`
+    keeps the program running only as long as it has something to do.
+    A thread takes the next job once it is done with the last one. Another thread is only started
+    to wait for the next job while every thread is busy running one, and it stops again after
+    it has not been needed for a while.
+
+    :param num_threads: Max number of jobs that can run at the same time. With 1 a slow job delays the others.
+    :param daemon: If `True` the threads will not keep the program from exiting
+    """
+
+    def __init__(self, num_threads=1, daemon=True):
+        if num_threads < 1:
+            raise ValueError("num_threads must be >= 1")
+        self.num_threads = num_threads
+        self.daemon = daemon
+
+        self._cond = threading.Condition(threading.Lock())
+        self._heap = []  # (run_at, order added, job)
+        self._counter = itertools.count()
+        self._cancelled = 0
+        self._running_threads = 0
+        self._idle_threads = 0  # Threads waiting for the next job, not running one
+        self._local = threading.local()  # `running` is set in the threads while they run a job
+
+    def schedule(self, run_at, func):
+        """
+        Call `func()` at `run_at` (in `time.monotonic()` time)
+        :return: job that can be passed to `cancel`
+        """
+        job = _Job(func)
+        with self._cond:
+            heapq.heappush(self._heap, (run_at, next(self._counter), job))
+            # A job adding the next run of itself (like `RepeatingTimer`) does not need a new thread,
+            # this thread will be waiting for it as soon as the job returns
+            if self._idle_threads == 0 and getattr(self._local, 'running', False) is False:
+                self._start_thread()
+            self._cond.notify()
+        return job
+
+    def _start_thread(self):
+        # Must hold self._cond
+        if self._running_threads >= self.num_threads:
+            return
+        self._running_threads += 1
+        self._idle_threads += 1
+        thread = threading.Thread(target=self._run, name='cutil-scheduler')
+        thread.daemon = self.daemon
+        thread.start()
+
+    def cancel(self, job):
+        with self._cond:
+            if job.cancelled or not job.pending:
+                return
+            job.cancelled = True
+            self._cancelled += 1
+            # Cancelled jobs are skipped when they come up, clean them out if there are a lot of them
+            if self._cancelled > 64 and self._cancelled > len(self._heap) // 2:
+                self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+            self._cond.notify()
+
+    def _run(self):
+        idle_since = time.monotonic()
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                    self._cancelled -= 1
+
+                now = time.monotonic()
+                spare = self._idle_threads > 1
+                if not self._heap or (spare and now - idle_since >= _spare_thread_timeout):
+                    # Nothing left to do or another thread is already waiting,
+                    # a new thread is started when one is needed
+                    self._running_threads -= 1
+                    self._idle_threads -= 1
+                    return
+
+                run_at, _, job = self._heap[0]
+                delay = run_at - now
+                if delay > 0:
+                    if spare:
+                        delay = min(delay, idle_since + _spare_thread_timeout - now)
+                    self._cond.wait(delay)
+                    continue
+
+                heapq.heappop(self._heap)
+                job.pending = False
+                self._idle_threads -= 1
+                if self._heap and self._idle_threads == 0:
+                    # Have another thread wait for the next job in case this one is slow
+                    self._start_thread()
+                self._cond.release()
+                self._local.running = True
+                try:
+                    job.func()
+                except Exception:
+                    logger.exception("Error running scheduled job {func}".format(func=job.func))
+                finally:
+                    self._local.running = False
+                    self._cond.acquire()
+
+                # Keep going instead of handing the next job to a new thread
+                self._idle_threads += 1
+                idle_since = time.monotonic()
+
+
+_default_schedulers = {}
+_default_schedulers_lock = threading.Lock()
+# Slow timers only delay the others once this many are running at the same time
+_default_scheduler_threads = 8
+
+
+def default_scheduler(daemon=False):
+    """
+    Shared scheduler used by `RepeatingTimer`s that are not given one
+    """
+    with _default_schedulers_lock:
+        if daemon not in _default_schedulers:
+            _default_schedulers[daemon] = Scheduler(num_threads=_default_scheduler_threads, daemon=daemon)
+        return _default_schedulers[daemon]
 
 
 class RepeatingTimer():
+    """
+    Call `func` every `interval` seconds
 
-    def __init__(self, interval, func, repeat=True, max_tries=None, args=(), kwargs={}):
+    All timers share a scheduler by default instead of starting a thread for each run. It uses a single
+    thread unless a timer is due while others are running, up to 8 threads.
+
+    :param fixed_rate: If `False` wait `interval` seconds after `func` is done before running it again.
+                       If `True` run it every `interval` seconds from when the timer was started, no matter
+                       how long `func` takes. Runs that were missed because `func` took too long are skipped.
+    :param scheduler: `Scheduler` to run `func` with, by default a shared one is used
+    """
+
+    def __init__(self, interval, func, repeat=True, max_tries=None, args=(), kwargs={}, daemon=False,
+                 fixed_rate=False, scheduler=None):
         self.interval = interval
         self.func = func
         self.repeat = repeat
@@ -11,27 +171,67 @@ class RepeatingTimer():
         self.try_count = 0
         self.args = args
         self.kwargs = kwargs
+        # Daemon timers do not keep the program running
+        self.daemon = daemon
+        self.fixed_rate = fixed_rate
+        self.scheduler = scheduler
 
-        self.timer = None
+        self._lock = threading.Lock()
+        self._job = None
+        # Bumped on every start/cancel so a run that was already picked by the scheduler can tell it is stale
+        self._generation = 0
 
-    def _callback(self):
-        self.try_count += 1
+    def _get_scheduler(self):
+        return self.scheduler or default_scheduler(self.daemon)
 
-        self.func(*self.args, **self.kwargs)
+    def _schedule(self, run_at):
+        # Must hold self._lock
+        self._generation += 1
+        self._job = self._get_scheduler().schedule(run_at, partial(self._callback, self._generation, run_at))
 
-        if self.repeat is True and (self.max_tries is None or self.try_count < self.max_tries):
-            self.reset()
-        else:
+    def _callback(self, generation, run_at):
+        with self._lock:
+            if generation != self._generation:
+                # Cancelled or reset after the job was picked to run
+                return
+            self.try_count += 1
+
+        try:
+            self.func(*self.args, **self.kwargs)
+        except Exception:
+            logger.exception("Error in RepeatingTimer function {func}".format(func=self.func))
             self.cancel()
+            return
+
+        with self._lock:
+            if generation != self._generation:
+                # Cancelled or reset by `func`
+                return
+
+            if self.repeat is True and (self.max_tries is None or self.try_count < self.max_tries):
+                now = time.monotonic()
+                if self.fixed_rate is True and self.interval > 0:
+                    run_at += self.interval
+                    if run_at < now:
+                        run_at += math.ceil((now - run_at) / self.interval) * self.interval
+                else:
+                    run_at = now + self.interval
+                self._schedule(run_at)
+            else:
+                self._generation += 1
+                self._job = None
 
     def cancel(self):
-        if self.timer is not None:
-            self.timer.cancel()
+        with self._lock:
+            self._generation += 1
+            job, self._job = self._job, None
+        if job is not None:
+            self._get_scheduler().cancel(job)
 
     def start(self):
-        self.timer = Timer(self.interval, self._callback)
-        self.timer.start()
+        self.cancel()
+        with self._lock:
+            self._schedule(time.monotonic() + self.interval)
 
     def reset(self):
-        self.cancel()
         self.start()
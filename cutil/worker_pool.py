@@ -0,0 +1,248 @@
+import os
+import math
+import queue
+import threading
+import collections
+
+# Result of a single item, `exception` is set instead of `result` if the callback raised one
+TaskResult = collections.namedtuple('TaskResult', ['item', 'result', 'exception'])
+
+_STOP = object()
+
+
+class ThreadPool:
+    """
+    Reusable pool of worker threads
+
+    Items are read from the input as results are consumed, at most `max_pending` items are in the pool
+    at a time, so generators of any size can be processed with flat memory.
+
+    Use `close()` (or a `with` block) to stop the worker threads once done with the pool.
+    """
+
+    def __init__(self, num_threads, max_pending=None):
+        if num_threads < 1:
+            raise ValueError("num_threads must be >= 1")
+        self.num_threads = num_threads
+        self.max_pending = max_pending or num_threads * 2
+
+        self._tasks = queue.Queue()
+        self._closed = False
+        self._threads = []
+        for _ in range(num_threads):
+            t = threading.Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _worker(self):
+        while True:
+            task = self._tasks.get()
+            if task is _STOP:
+                break
+
+            index, item, callback, args, kwargs, results, cancelled = task
+            if cancelled.is_set():
+                continue
+            try:
+                task_result = TaskResult(item, callback(item, *args, **kwargs), None)
+            except Exception as e:
+                task_result = TaskResult(item, None, e)
+            results.put((index, task_result))
+
+    def imap(self, callback, data, *args, ordered=True, **kwargs):
+        """
+        Run `callback(item, *args, **kwargs)` for each item in `data`
+
+        :param ordered: If `True` the results are yielded in the same order as `data`,
+                        otherwise they are yielded as soon as they are done
+        :return: generator of `TaskResult(item, result, exception)`
+        """
+        if self._closed:
+            raise RuntimeError("Can not use a closed ThreadPool")
+
+        items = iter(data)
+        results = queue.Queue()
+        cancelled = threading.Event()
+        next_index = 0  # Index of the next item to send to the workers
+        yield_index = 0  # Index of the next result to yield when ordered
+        done = {}  # Finished results that are waiting for an earlier result when ordered
+        pending = 0
+        items_left = True
+
+        try:
+            while True:
+                # Keep the workers busy without reading too far ahead, results waiting in `done`
+                # for an earlier item still count so one slow item can not let the input run ahead
+                while items_left and pending + len(done) < self.max_pending:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        items_left = False
+                        break
+                    self._tasks.put((next_index, item, callback, args, kwargs, results, cancelled))
+                    next_index += 1
+                    pending += 1
+
+                if pending == 0:
+                    break
+
+                index, task_result = results.get()
+                pending -= 1
+                if ordered is not True:
+                    yield task_result
+                    continue
+
+                done[index] = task_result
+                while yield_index in done:
+                    yield done.pop(yield_index)
+                    yield_index += 1
+
+        finally:
+            # Skip any items still waiting in the queue if the results are no longer wanted
+            cancelled.set()
+
+    def map(self, callback, data, *args, ordered=True, **kwargs):
+        """
+        Same as `imap` but only yields the results, raising the exception of the first item that failed
+        """
+        for task_result in self.imap(callback, data, *args, ordered=ordered, **kwargs):
+            if task_result.exception is not None:
+                raise task_result.exception
+            yield task_result.result
+
+    def close(self, wait=True):
+        """
+        Stop the worker threads once they have finished the items they are working on
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._tasks.put(_STOP)
+        if wait is True:
+            for t in self._threads:
+                t.join()
+
+
+def _run_chunk(callback, chunk, args, kwargs):
+    """ Run the callback for each item of a chunk inside of a worker process
+    :return: list of (result, exception) for each item
+    """
+    results = []
+    for item in chunk:
+        try:
+            results.append((callback(item, *args, **kwargs), None))
+        except Exception as e:
+            results.append((None, e))
+    return results
+
+
+class ProcessPool:
+    """
+    Pool of worker processes with the same `imap`/`map` interface as `ThreadPool`
+
+    Items are sent to the processes in chunks to cut down on the pickling/IPC overhead,
+    at most `max_pending` chunks are sent ahead of the results being consumed.
+    `callback`, its args and the items must be picklable.
+
+    :param initializer: Called with `initargs` once in each process when it starts
+    """
+
+    def __init__(self, num_processes=None, initializer=None, initargs=(), max_pending=None):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.num_processes = num_processes or os.cpu_count() or 1
+        self.max_pending = max_pending or self.num_processes * 2
+        self._executor = ProcessPoolExecutor(max_workers=self.num_processes,
+                                             initializer=initializer,
+                                             initargs=initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def imap(self, callback, data, *args, chunk_size=None, ordered=True, **kwargs):
+        """
+        Run `callback(item, *args, **kwargs)` for each item in `data`
+
+        :param chunk_size: Number of items sent to a process at a time. Defaults to splitting a list into
+                           4 chunks per process, or 100 items at a time for other iterables
+        :param ordered: If `True` the results are yielded in the same order as `data`,
+                        otherwise a chunk's results are yielded as soon as the chunk is done
+        :return: generator of `TaskResult(item, result, exception)`
+        """
+        from concurrent.futures import FIRST_COMPLETED, wait
+        from cutil import chunks_of
+
+        if chunk_size is None:
+            if isinstance(data, (list, tuple)):
+                chunk_size = max(1, math.ceil(len(data) / (self.num_processes * 4)))
+            else:
+                chunk_size = 100
+
+        chunks = enumerate(chunks_of(chunk_size, data))
+        running = {}
+        done = {}
+        yield_index = 0
+        chunks_left = True
+
+        try:
+            while True:
+                while chunks_left and len(running) + len(done) < self.max_pending:
+                    try:
+                        index, chunk = next(chunks)
+                    except StopIteration:
+                        chunks_left = False
+                        break
+                    future = self._executor.submit(_run_chunk, callback, chunk, args, kwargs)
+                    running[future] = (index, chunk)
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index, chunk = running.pop(future)
+                    try:
+                        chunk_results = future.result()
+                    except Exception as e:
+                        # The chunk could not be sent to or run in the process
+                        chunk_results = [(None, e)] * len(chunk)
+                    task_results = [TaskResult(item, result, exception)
+                                    for item, (result, exception) in zip(chunk, chunk_results)]
+                    if ordered is not True:
+                        yield from task_results
+                    else:
+                        done[index] = task_results
+
+                while yield_index in done:
+                    yield from done.pop(yield_index)
+                    yield_index += 1
+
+        finally:
+            for future in running:
+                future.cancel()
+
+    def map(self, callback, data, *args, chunk_size=None, ordered=True, **kwargs):
+        """
+        Same as `imap` but only yields the results, raising the exception of the first item that failed
+        """
+        for task_result in self.imap(callback, data, *args, chunk_size=chunk_size, ordered=ordered, **kwargs):
+            if task_result.exception is not None:
+                raise task_result.exception
+            yield task_result.result
+
+    def close(self, wait=True):
+        """
+        Stop the worker processes
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=True)
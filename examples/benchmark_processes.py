@@ -0,0 +1,43 @@
+"""
+Compare `cutil.threads` and `cutil.processes` on a cpu bound callback
+
+Threads are limited by the GIL for work like this, processes are not but have to
+pickle every item and result, so the gain depends on the number of cores and the size of the work.
+
+    $ python examples/benchmark_processes.py 2000 4
+"""
+import sys
+import time
+import hashlib
+
+import cutil
+
+
+def hash_item(item, rounds=200):
+    value = str(item).encode()
+    for _ in range(rounds):
+        value = hashlib.sha256(value).digest()
+    return value.hex()
+
+
+def main():
+    num_items = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    data = list(range(num_items))
+
+    start_time = time.perf_counter()
+    for item in data:
+        hash_item(item)
+    print("{name:>9}: {items} items in {seconds:.2f}s"
+          .format(name='serial', items=num_items, seconds=time.perf_counter() - start_time))
+
+    for name, run in (('threads', cutil.threads), ('processes', cutil.processes)):
+        start_time = time.perf_counter()
+        results = run(num_workers, data, hash_item)
+        print("{name:>9}: {items} items in {seconds:.2f}s with {workers} workers"
+              .format(name=name, items=len(results), seconds=time.perf_counter() - start_time,
+                      workers=num_workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Compare the `values` and `staging` upsert methods of `cutil.Database`
+
+Set the env vars `DB_NAME`, `DB_USER`, `DB_HOST`, `DB_PASS` (and optionally `DB_PORT`)
+to point at a postgres database the benchmark can create the table `cutil_upsert_benchmark` in.
+
+    $ python examples/benchmark_upsert.py 100000
+"""
+import os
+import sys
+import time
+
+import cutil
+
+TABLE = 'cutil_upsert_benchmark'
+
+
+def make_rows(num_rows, price_offset):
+    for i in range(num_rows):
+        yield {'sku': 'sku-{0}'.format(i), 'name': 'Item {0}'.format(i), 'price': i + price_offset}
+
+
+def run(db, method, num_rows):
+    with db.getcursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS {table}; "
+                    "CREATE TABLE {table} (id serial PRIMARY KEY, sku text UNIQUE, name text, price numeric)"
+                    .format(table=TABLE))
+
+    timings = {}
+    # First pass inserts everything, second pass updates everything
+    for run_name, price_offset in (('insert', 0), ('update', 1)):
+        data = make_rows(num_rows, price_offset)
+        if method == 'values':
+            data = list(data)
+        start_time = time.perf_counter()
+        db.upsert(TABLE, data, 'sku', method=method, return_cols=None)
+        timings[run_name] = time.perf_counter() - start_time
+
+    return timings
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    db = cutil.Database({'db_name': os.environ['DB_NAME'],
+                         'db_user': os.environ['DB_USER'],
+                         'db_host': os.environ['DB_HOST'],
+                         'db_pass': os.environ['DB_PASS'],
+                         'db_port': os.environ.get('DB_PORT'),
+                         })
+    try:
+        for method in ('values', 'staging'):
+            timings = run(db, method, num_rows)
+            print("{method:>8}: {rows} rows - insert {insert:.2f}s, update {update:.2f}s"
+                  .format(method=method, rows=num_rows, **timings))
+    finally:
+        with db.getcursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS {table}".format(table=TABLE))
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
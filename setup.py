@@ -7,6 +7,11 @@ postgres = [
     'psycopg2-binary',
 ]
 
+postgres_async = [
+    'psycopg[binary]>=3.1',
+    'psycopg_pool',
+]
+
 setup(
     name='cutil',
     packages=['cutil'],
@@ -32,5 +37,7 @@ setup(
     ],
     extras_require={
         'postgres': postgres,
+        'postgres_async': postgres_async,
+        'numpy': ['numpy'],
     }
 )
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def db_config():
+    """
+    Database tests only run when the env vars `DB_NAME`, `DB_USER`, `DB_HOST`, `DB_PASS` (and optionally `DB_PORT`)
+    point at a postgres database the tests can create tables in
+    """
+    if not all(os.environ.get(name) for name in ('DB_NAME', 'DB_USER', 'DB_HOST', 'DB_PASS')):
+        pytest.skip("Set DB_NAME, DB_USER, DB_HOST and DB_PASS to run the database tests")
+    return {'db_name': os.environ['DB_NAME'],
+            'db_user': os.environ['DB_USER'],
+            'db_host': os.environ['DB_HOST'],
+            'db_pass': os.environ['DB_PASS'],
+            'db_port': os.environ.get('DB_PORT'),
+            }
+
+
+@pytest.fixture
+def db(db_config):
+    import cutil
+
+    db = cutil.Database(db_config, cache_size=100)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def table(db):
+    """ Name of an empty table that is dropped after the test """
+    name = 'cutil_test_items'
+    with db.getcursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS {table}; "
+                    "CREATE TABLE {table} (id serial PRIMARY KEY, sku text UNIQUE, name text, price numeric, "
+                    "tags text[], meta jsonb)".format(table=name))
+    yield name
+    with db.getcursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS {table}".format(table=name))
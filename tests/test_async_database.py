@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+TABLE = 'cutil_test_async_items'
+
+
+@pytest.fixture
+def run_db(db_config):
+    """ Run `func(db)` with an `AsyncDatabase` on a fresh table, returns what `func` returns """
+    pytest.importorskip('psycopg_pool')
+    from cutil.async_database import AsyncDatabase
+
+    def run(func):
+        async def _run():
+            async with AsyncDatabase(dict(db_config)) as db:
+                async with db.getcursor() as cur:
+                    await cur.execute("DROP TABLE IF EXISTS {table}; "
+                                      "CREATE TABLE {table} (id serial PRIMARY KEY, sku text UNIQUE, price numeric, "
+                                      "tags text[])".format(table=TABLE))
+                try:
+                    return await func(db)
+                finally:
+                    async with db.getcursor() as cur:
+                        await cur.execute("DROP TABLE IF EXISTS {table}".format(table=TABLE))
+        return asyncio.run(_run())
+    return run
+
+
+async def _rows(db):
+    async with db.getcursor() as cur:
+        await cur.execute("SELECT sku, price, tags FROM {table} ORDER BY sku".format(table=TABLE))
+        return [(sku, None if price is None else float(price), tags) for sku, price, tags in await cur.fetchall()]
+
+
+@pytest.mark.parametrize('method, copy_format', [('values', None), ('copy', 'text'), ('copy', 'csv')])
+def test_insert(run_db, method, copy_format):
+    rows = [{'sku': 'a', 'price': 1, 'tags': ['x', None]}, {'sku': 'b', 'price': None, 'tags': None}]
+
+    async def test(db):
+        kwargs = {'copy_format': copy_format} if copy_format else {}
+        result = await db.insert(TABLE, rows, method=method, **kwargs)
+        return result, await _rows(db)
+
+    result, rows_in_db = run_db(test)
+    assert len(result) == 2
+    assert rows_in_db == [('a', 1.0, ['x', None]), ('b', None, None)]
+
+
+@pytest.mark.parametrize('method', ['values', 'staging'])
+def test_upsert(run_db, method):
+    async def test(db):
+        await db.insert(TABLE, [{'sku': 'a', 'price': 1}])
+        await db.upsert(TABLE, [{'sku': 'a', 'price': 10}, {'sku': 'b', 'price': 2}], 'sku', method=method,
+                        return_cols=None)
+        return await _rows(db)
+
+    assert run_db(test) == [('a', 10.0, None), ('b', 2.0, None)]
+
+
+@pytest.mark.parametrize('method', ['each', 'bulk'])
+def test_update(run_db, method):
+    async def test(db):
+        await db.insert(TABLE, [{'sku': 'a', 'price': 1}, {'sku': 'b', 'price': 2}])
+        result = await db.update(TABLE, [{'sku': 'a', 'price': 10}, {'sku': 'x', 'price': 5}], matched_field='sku',
+                                 method=method)
+        return result, await _rows(db)
+
+    result, rows_in_db = run_db(test)
+    assert len(result) == 1
+    assert rows_in_db == [('a', 10.0, None), ('b', 2.0, None)]
+
+
+@pytest.mark.parametrize('method', ['values', 'copy'])
+def test_insert_rows_with_different_keys(run_db, method):
+    async def test(db):
+        with pytest.raises(ValueError):
+            await db.insert(TABLE, [{'sku': 'a', 'price': 1}, {'sku': 'b'}], method=method)
+        return await _rows(db)
+
+    assert run_db(test) == []
@@ -0,0 +1,78 @@
+import asyncio
+import itertools
+
+import pytest
+
+from cutil import amap
+
+
+async def _slow_first(item):
+    await asyncio.sleep(0.3 if item == 0 else 0)
+    return item * 2
+
+
+def test_amap_ordered():
+    async def run():
+        return [task async for task in amap(_slow_first, range(20), concurrency=4, ordered=True)]
+
+    results = asyncio.run(run())
+    assert [task.result for task in results] == [i * 2 for i in range(20)]
+
+
+def test_amap_async_generator_and_exception():
+    async def items():
+        for i in range(5):
+            yield i
+
+    def callback(item):
+        if item == 3:
+            raise ValueError("bad item")
+        return item
+
+    async def run():
+        return [task async for task in amap(callback, items(), concurrency=2)]
+
+    results = asyncio.run(run())
+    assert sorted(task.item for task in results) == list(range(5))
+    assert [task.item for task in results if isinstance(task.exception, ValueError)] == [3]
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_amap_slow_head_does_not_read_ahead(ordered):
+    read = []
+
+    def items():
+        for i in itertools.count():
+            read.append(i)
+            yield i
+
+    async def run():
+        results = amap(_slow_first, items(), concurrency=8, ordered=ordered)
+        first = await results.__anext__()
+        # The slow first item holds back the ordered results, but the input must not run ahead of it
+        assert len(read) <= 8 + 1
+        await results.aclose()
+        return first
+
+    first = asyncio.run(run())
+    if ordered:
+        assert first.item == 0
+
+
+def test_amap_concurrency():
+    running = 0
+    most_running = 0
+
+    async def callback(item):
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    async def run():
+        async for _ in amap(callback, range(50), concurrency=5):
+            pass
+
+    asyncio.run(run())
+    assert most_running == 5
@@ -0,0 +1,124 @@
+import time
+import threading
+
+import pytest
+
+from cutil import BufferedWriter
+
+
+class FakeDB:
+    """ Records the rows written, writes to a table in `fail` raise """
+
+    def __init__(self, delays=None):
+        self.written = []
+        self.fail = set()
+        # Seconds to sleep before writing a batch that starts with this row
+        self.delays = delays or {}
+
+    def _write(self, operation, table, rows):
+        rows = list(rows)
+        time.sleep(self.delays.get(repr(rows[0]), 0))
+        if table in self.fail:
+            raise RuntimeError("write to {0} failed".format(table))
+        self.written.append((operation, table, rows))
+
+    def insert(self, table, rows, **kwargs):
+        self._write('insert', table, rows)
+
+    def upsert(self, table, rows, on_conflict_fields, **kwargs):
+        self._write('upsert', table, rows)
+
+    def update(self, table, rows, **kwargs):
+        self._write('update', table, rows)
+
+
+def test_flush_groups_rows():
+    db = FakeDB()
+    with BufferedWriter(db, flush_interval=None) as writer:
+        writer.insert('a', [{'i': 1}, {'i': 2}])
+        writer.insert('b', {'i': 3})
+        writer.upsert('a', [{'i': 4}], 'i')
+        assert db.written == []
+    assert sorted(db.written) == [('insert', 'a', [{'i': 1}, {'i': 2}]), ('insert', 'b', [{'i': 3}]),
+                                  ('upsert', 'a', [{'i': 4}])]
+    assert writer.rows_written == 4
+
+
+def test_insert_rows_grouped_by_keys():
+    db = FakeDB()
+    with BufferedWriter(db, flush_interval=None) as writer:
+        writer.insert('a', [{'i': 1}, {'i': 2, 'j': 2}, {'i': 3}])
+    assert sorted((rows for _, _, rows in db.written), key=len) == [[{'i': 2, 'j': 2}], [{'i': 1}, {'i': 3}]]
+
+
+def test_flush_failure_keeps_other_buffers_and_puts_rows_back():
+    db = FakeDB()
+    db.fail.add('bad')
+    writer = BufferedWriter(db, flush_interval=None)
+    writer.insert('bad', [{'i': 1}])
+    writer.insert('good', [{'i': 2}])
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    assert db.written == [('insert', 'good', [{'i': 2}])]
+
+    # The failed rows go back in front of newer rows and are written by the next flush
+    writer.insert('bad', [{'i': 3}])
+    db.fail.clear()
+    writer.close()
+    assert db.written[-1] == ('insert', 'bad', [{'i': 1}, {'i': 3}])
+
+
+def test_on_error():
+    db = FakeDB()
+    db.fail.add('bad')
+    errors = []
+    with BufferedWriter(db, flush_interval=None, on_error=lambda *args: errors.append(args)) as writer:
+        writer.insert('bad', [{'i': 1}])
+        writer.insert('good', [{'i': 2}])
+    assert [(operation, table, rows) for operation, table, rows, _ in errors] == [('insert', 'bad', [{'i': 1}])]
+    assert isinstance(errors[0][3], RuntimeError)
+    assert db.written == [('insert', 'good', [{'i': 2}])]
+
+
+def test_full_buffer_failure_puts_rows_back():
+    db = FakeDB()
+    db.fail.add('a')
+    writer = BufferedWriter(db, max_rows=3, flush_interval=None)
+    writer.insert('a', [{'i': 1}, {'i': 2}])
+    with pytest.raises(RuntimeError):
+        writer.insert('a', [{'i': 3}])
+
+    # No rows are lost, including the ones other calls added
+    db.fail.clear()
+    writer.close()
+    assert db.written == [('insert', 'a', [{'i': 1}, {'i': 2}, {'i': 3}])]
+
+
+def test_timer_keeps_running_when_on_error_raises():
+    db = FakeDB()
+    db.fail.add('a')
+    calls = []
+
+    def on_error(*args):
+        calls.append(args)
+        raise ValueError("on_error failed")
+
+    writer = BufferedWriter(db, flush_interval=0.02, on_error=on_error)
+    writer.insert('a', [{'i': 1}])
+    time.sleep(0.1)
+    writer.insert('a', [{'i': 2}])
+    time.sleep(0.1)
+    writer._timer.cancel()
+    assert [rows for _, _, rows, _ in calls] == [[{'i': 1}], [{'i': 2}]]
+
+
+def test_same_key_written_in_order():
+    # The first batch is slow to write, the second one has to wait for it
+    db = FakeDB(delays={repr([{'i': 1}]): 0.2})
+    writer = BufferedWriter(db, max_rows=1, flush_interval=None)
+    first = threading.Thread(target=writer.upsert, args=('a', [{'i': 1}], 'i'))
+    first.start()
+    time.sleep(0.05)
+    writer.upsert('a', [{'i': 2}], 'i')
+    first.join()
+    assert [rows for _, _, rows in db.written] == [[{'i': 1}], [{'i': 2}]]
@@ -0,0 +1,197 @@
+import pytest
+
+
+def _rows(db, table):
+    with db.getcursor() as cur:
+        cur.execute("SELECT sku, name, price, tags, meta FROM {table} ORDER BY sku".format(table=table))
+        return [(sku, name, None if price is None else float(price), tags, meta)
+                for sku, name, price, tags, meta in cur.fetchall()]
+
+
+ROWS = [{'sku': 'a', 'name': 'Tab\there', 'price': 1.5, 'tags': ['x', 'y "z"', None], 'meta': {'k': [1, 2]}},
+        {'sku': 'b', 'name': '', 'price': None, 'tags': [], 'meta': None},
+        {'sku': 'c', 'name': None, 'price': 3, 'tags': None, 'meta': {'back\\slash': 'new\nline'}},
+        ]
+
+
+def test_insert_values(db, table):
+    # Values can not adapt a dict, the COPY formats send it as json
+    rows = [dict(row, meta=None) for row in ROWS]
+    result = db.insert(table, rows)
+    assert len(result) == 3
+    assert _rows(db, table) == [(row['sku'], row['name'], row['price'], row['tags'], None) for row in ROWS]
+
+
+@pytest.mark.parametrize('copy_format', ['text', 'csv'])
+def test_insert_copy(db, table, copy_format):
+    result = db.insert(table, iter(ROWS), method='copy', copy_format=copy_format)
+    assert len(result) == 3
+    assert db.insert(table, [{'sku': 'd'}], method='copy', copy_format=copy_format, return_cols=None) is None
+    expected = [(row['sku'], row['name'], row['price'], row['tags'], row['meta']) for row in ROWS]
+    assert _rows(db, table) == expected + [('d', None, None, None, None)]
+
+
+def test_insert_copy_binary(db, table):
+    rows = [{'sku': row['sku'], 'name': row['name'], 'meta': row['meta']} for row in ROWS]
+    db.insert(table, rows, method='copy', copy_format='binary', return_cols=None)
+    assert [(sku, name, meta) for sku, name, _, _, meta in _rows(db, table)] == \
+        [(row['sku'], row['name'], row['meta']) for row in rows]
+
+
+@pytest.mark.parametrize('method', ['values', 'copy'])
+def test_insert_rows_with_different_keys(db, table, method):
+    # A missing key must not be written as NULL, and an extra key must not be dropped
+    for rows in ([{'sku': 'a', 'name': 'A'}, {'sku': 'b'}],
+                 [{'sku': 'a'}, {'sku': 'b', 'name': 'B'}]):
+        with pytest.raises(ValueError):
+            db.insert(table, rows, method=method)
+    assert _rows(db, table) == []
+
+
+@pytest.mark.parametrize('method', ['values', 'staging'])
+def test_upsert_rows_with_different_keys(db, table, method):
+    db.insert(table, [{'sku': 'b', 'name': 'B'}])
+    with pytest.raises(ValueError):
+        db.upsert(table, [{'sku': 'a', 'name': 'A'}, {'sku': 'b'}], 'sku', method=method)
+    assert [(sku, name) for sku, name, _, _, _ in _rows(db, table)] == [('b', 'B')]
+
+
+def test_insert_tuples_with_columns(db, table):
+    db.insert(table, [('a', 1), ('b', 2)], columns=['sku', 'price'], method='copy', return_cols=None)
+    assert [(sku, price) for sku, _, price, _, _ in _rows(db, table)] == [('a', 1.0), ('b', 2.0)]
+
+
+@pytest.mark.parametrize('method', ['values', 'staging'])
+def test_upsert(db, table, method):
+    db.insert(table, [{'sku': 'a', 'price': 1}, {'sku': 'b', 'price': 2}])
+    rows = [{'sku': 'a', 'price': 10}, {'sku': 'c', 'price': 30}]
+    db.upsert(table, rows, 'sku', method=method, return_cols=None)
+    assert [(sku, price) for sku, _, price, _, _ in _rows(db, table)] == [('a', 10.0), ('b', 2.0), ('c', 30.0)]
+
+
+def test_upsert_staging_dedup(db, table):
+    rows = [{'sku': 'a', 'price': 1}, {'sku': 'a', 'price': 2},
+            {'sku': None, 'price': 3}, {'sku': None, 'price': 4}]
+    db.upsert(table, rows, 'sku', method='staging', return_cols=None)
+    with db.getcursor() as cur:
+        cur.execute("SELECT sku, price FROM {table} ORDER BY price".format(table=table))
+        # The last duplicate wins, rows with a NULL key are all kept
+        assert [(sku, float(price)) for sku, price in cur.fetchall()] == [('a', 2.0), (None, 3.0), (None, 4.0)]
+
+
+@pytest.mark.parametrize('method', ['each', 'bulk'])
+def test_update(db, table, method):
+    db.insert(table, [{'sku': 'a', 'price': 1, 'name': 'A'}, {'sku': 'b', 'price': 2, 'name': 'B'}])
+    result = db.update(table, [{'sku': 'x', 'price': 5}, {'sku': 'a', 'price': 10}], matched_field='sku',
+                       method=method)
+    assert len(result) == 1
+    assert [(sku, name, price) for sku, name, price, _, _ in _rows(db, table)] == [('a', 'A', 10.0), ('b', 'B', 2.0)]
+
+
+def test_bulk_update_different_keys(db, table):
+    db.insert(table, [{'sku': 'a', 'price': 1, 'name': 'A'}])
+    with pytest.raises(ValueError):
+        db.update(table, [{'sku': 'a', 'price': 10}, {'sku': 'a', 'name': 'B'}], matched_field='sku', method='bulk')
+    assert [(name, price) for _, name, price, _, _ in _rows(db, table)] == [('A', 1.0)]
+
+
+def test_transaction_rollback(db, table):
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.insert(table, [{'sku': 'a'}])
+            raise RuntimeError("stop")
+    assert _rows(db, table) == []
+
+
+def test_cached_query(db, table):
+    db.insert(table, [{'sku': 'a', 'price': 1}])
+    query = "SELECT sku FROM {table}".format(table=table)
+    assert db.cached_query(query) == [('a',)]
+    assert db.cached_query(query) == [('a',)]
+    assert db.cache.hits == 1
+
+    # Writes through the Database invalidate the cached results
+    db.insert(table, [{'sku': 'b', 'price': 2}])
+    assert sorted(db.cached_query(query)) == [('a',), ('b',)]
+
+
+def test_cached_query_without_tables(db):
+    assert db.cached_query("SELECT now()") != db.cached_query("SELECT now()")
+    assert len(db.cache._entries) == 0
+
+
+def test_cached_query_every_table_in_from(db, table):
+    with db.getcursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS cutil_test_other; CREATE TABLE cutil_test_other (id serial PRIMARY KEY)")
+    try:
+        query = "SELECT i.sku, o.id FROM {table} i, cutil_test_other o WHERE i.id = o.id".format(table=table)
+        db.insert(table, [{'sku': 'a'}])
+        assert db.cached_query(query) == []
+        db.insert('cutil_test_other', [{'id': 1}])
+        assert db.cached_query(query) == [('a', 1)]
+    finally:
+        with db.getcursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS cutil_test_other")
+
+
+def test_parallel_load(db, table):
+    rows = [{'sku': str(i), 'price': i} for i in range(100)]
+    summary = db.parallel_load(table, rows, num_workers=4, return_cols=None)
+    assert summary['errors'] == []
+    assert summary['rows'] == 100
+    assert len(_rows(db, table)) == 100
+
+
+def test_parallel_load_empty_and_single_row(db, table):
+    summary = db.parallel_load(table, [])
+    assert (summary['rows'], summary['partitions'], summary['errors']) == (0, 0, [])
+
+    summary = db.parallel_load(table, {'sku': 'a', 'price': 1})
+    assert (summary['rows'], summary['partitions'], len(summary['results'])) == (1, 1, 1)
+    assert [(sku, price) for sku, _, price, _, _ in _rows(db, table)] == [('a', 1.0)]
+
+
+class FakeNamedCursor:
+    """ Like a psycopg2 named cursor, `description` is only set once the first rows are fetched """
+
+    def __init__(self, description, rows):
+        self._description = description
+        self.rows = list(rows)
+        self.description = None
+
+    def fetchmany(self, size):
+        self.description = self._description
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+@pytest.mark.parametrize('num_rows', [0, 1, 5])
+def test_fetch_columns_named_cursor(num_rows):
+    from cutil import Database
+
+    rows = [(i, i / 2, None if i == 3 else 'name{0}'.format(i)) for i in range(num_rows)]
+    description = [('id', 23), ('price', 701), ('name', 25)]
+    # `fetch_columns` does not use the connection pool
+    db = Database.__new__(Database)
+
+    data = db.fetch_columns(FakeNamedCursor(description, rows), batch_size=2)
+    assert data == {'id': [row[0] for row in rows],
+                    'price': [row[1] for row in rows],
+                    'name': [row[2] for row in rows]}
+
+    np = pytest.importorskip('numpy')
+    data = db.fetch_columns(FakeNamedCursor(description, rows), batch_size=2, as_numpy=True)
+    assert list(data) == ['id', 'price', 'name']
+    assert (data['id'].dtype, data['price'].dtype, data['name'].dtype) == (np.dtype('int64'), np.dtype('float64'),
+                                                                           np.dtype(object))
+    assert data['id'].tolist() == [row[0] for row in rows]
+    assert data['name'].tolist() == [row[2] for row in rows]
+
+
+def test_fetch_columns_server_side_cursor(db, table):
+    db.insert(table, [{'sku': str(i), 'price': i} for i in range(5)])
+    with db.getcursor(name='cutil_test_fetch_columns') as cur:
+        cur.execute("SELECT sku, price FROM {table} ORDER BY id".format(table=table))
+        data = db.fetch_columns(cur, batch_size=2)
+    assert data['sku'] == ['0', '1', '2', '3', '4']
+    assert [float(price) for price in data['price']] == [0, 1, 2, 3, 4]
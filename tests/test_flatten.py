@@ -0,0 +1,91 @@
+import pytest
+
+from cutil import compile_flattener, flatten, flatten_records, unflatten
+
+
+NESTED = {'a': {'b': 1, 'c': {'d': 2, 'e': [3]}}, 'f': 4, 5: {'g': None}}
+
+
+@pytest.mark.parametrize('sep, expected', [
+    ('_', {'a_b': 1, 'a_c_d': 2, 'a_c_e': [3], 'f': 4, '5_g': None}),
+    ('.', {'a.b': 1, 'a.c.d': 2, 'a.c.e': [3], 'f': 4, '5.g': None}),
+    ('__', {'a__b': 1, 'a__c__d': 2, 'a__c__e': [3], 'f': 4, '5__g': None}),
+])
+def test_flatten_sep(sep, expected):
+    result = flatten(NESTED, sep=sep)
+    assert result == expected
+    # The keys keep the order of the nested dicts
+    assert list(result) == list(expected)
+    assert compile_flattener(NESTED, sep=sep)(NESTED) == expected
+    assert list(flatten_records([NESTED], sep=sep)) == [expected]
+
+
+def test_flatten_prev_key():
+    assert flatten({'a': {'b': 1}}, prev_key='x', sep='.') == {'x.a.b': 1}
+
+
+@pytest.mark.parametrize('sep', ['_', '.', '::'])
+def test_unflatten_round_trip(sep):
+    nested = {'a': {'b': 1, 'c': {'d': 2}}, 'e': [3], 'f': {}}
+    flat = flatten(nested, sep=sep)
+    # Empty dicts leave no keys behind so they can not come back
+    assert unflatten(flat, sep=sep) == {'a': {'b': 1, 'c': {'d': 2}}, 'e': [3]}
+    assert flatten(unflatten(flat, sep=sep), sep=sep) == flat
+
+
+@pytest.mark.parametrize('flat', [
+    {'a': 1, 'a_b': 2},
+    {'a_b': 2, 'a': 1},
+])
+def test_unflatten_conflict(flat):
+    with pytest.raises(ValueError):
+        unflatten(flat)
+
+
+@pytest.mark.parametrize('record', [
+    {'a': {'b': {'x': 1}, 'c': {'d': 2, 'e': [3]}}, 'f': 4, 5: {'g': None}},  # Leaf replaced by a dict
+    {'a': {'b': 1, 'c': {'d': 2, 'e': {'x': 3}}}, 'f': 4, 5: {'g': None}},  # Nested leaf replaced by a dict
+    {'a': 1, 'f': 4, 5: {'g': None}},  # Dict replaced by a leaf
+    {'a': {'b': 1, 'c': {'d': 2, 'e': [3]}}, 'f': 4},  # Missing key
+    {'a': {'b': 1, 'c': {'d': 2, 'e': [3]}}, 'f': 4, 6: {'g': None}},  # Different key
+    {'a': {'b': 1, 'c': {'d': 2, 'e': [3]}}, 'f': 4, 5: {'g': None}, 'h': 5},  # Extra key
+    [1, 2, 3],
+])
+def test_compile_flattener_shape_mismatch(record):
+    flattener = compile_flattener(NESTED)
+    with pytest.raises(ValueError):
+        flattener(record)
+
+
+def test_compile_flattener_other_values():
+    flattener = compile_flattener(NESTED)
+    record = {'a': {'b': 'x', 'c': {'d': [], 'e': None}}, 'f': 4.5, 5: {'g': (1, 2)}}
+    assert flattener(record) == flatten(record)
+
+
+def test_compile_flattener_unsupported_keys():
+    with pytest.raises(ValueError):
+        compile_flattener({('a', 'b'): 1})
+
+
+def test_flatten_records_mixed_shapes():
+    records = [
+        {'a': {'b': 1}, 'c': 2},
+        {'a': {'b': 3}, 'c': 4},
+        {'a': {'b': {'x': 5}}, 'c': 6},  # Same keys but a leaf is now a dict
+        {'a': 7, 'c': 8},  # Same keys but a dict is now a leaf
+        {'a': {'b': 9}},
+        {(1, 2): {'b': 10}},  # Can not be compiled
+        {'a': {'b': 11}, 'c': 12},
+        {},
+    ]
+    assert list(flatten_records(records)) == [flatten(record) for record in records]
+    assert list(flatten_records(records, sep='.')) == [flatten(record, sep='.') for record in records]
+
+
+@pytest.mark.parametrize('max_shapes', [1, 2, 8])
+def test_flatten_records_many_shapes(max_shapes):
+    # Shapes come back after others were pushed out, and later on every record has a shape of its own
+    records = [{'k{0}'.format(i % 12): {'v': i}, 'n': {'m': i}} for i in range(100)]
+    records += [{'u{0}'.format(i): {'v': i}} for i in range(200)]
+    assert list(flatten_records(records, max_shapes=max_shapes)) == [flatten(record) for record in records]
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+
+import pytest
+
+from cutil import MetricsRegistry, Histogram
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for value in range(1, 1001):
+        histogram.add(value)
+    assert histogram.count == 1000
+    assert histogram.percentile(50) == pytest.approx(500, rel=0.02)
+    assert histogram.percentile(99) == pytest.approx(990, rel=0.02)
+
+
+def test_threads_are_merged():
+    registry = MetricsRegistry(sink=lambda snapshot: None)
+
+    def work():
+        for _ in range(100):
+            registry.incr('calls')
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert registry.snapshot()['counters'] == {'calls': 400}
+    # Shards of finished threads are merged so they do not pile up, and their values are kept
+    assert len(registry._shards) == 0
+    assert registry.snapshot()['counters'] == {'calls': 400}
+
+
+def test_flush_resets():
+    sent = []
+    registry = MetricsRegistry(sink=sent.append)
+    registry.observe('size', 10)
+    registry.flush()
+    registry.flush()
+    assert len(sent) == 1
+    assert sent[0]['histograms']['size']['count'] == 1
+
+
+def test_timer_shared_by_coroutines():
+    registry = MetricsRegistry(sink=lambda snapshot: None)
+    timer = registry.timer('sleep')
+
+    async def sleep(seconds):
+        with timer:
+            await asyncio.sleep(seconds)
+
+    async def run():
+        await asyncio.gather(sleep(0.2), sleep(0.01))
+
+    asyncio.run(run())
+    stats = registry.snapshot()['histograms']['sleep']
+    assert stats['min'] < 0.1
+    assert stats['max'] >= 0.2
+
+
+def test_timer_errors():
+    registry = MetricsRegistry(sink=lambda snapshot: None)
+
+    @registry.timer('fail')
+    def fail():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        fail()
+    snapshot = registry.snapshot()
+    assert snapshot['counters'] == {'fail.errors': 1}
+    assert snapshot['histograms']['fail']['count'] == 1
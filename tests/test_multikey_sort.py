@@ -0,0 +1,66 @@
+import random
+from functools import cmp_to_key
+from operator import itemgetter
+
+import pytest
+
+from cutil import multikey_sort
+
+
+def _reference_sort(items, columns):
+    """ The original cmp based multikey_sort, the new modes must give the same order """
+    comparers = [((itemgetter(col[1:].strip()), -1) if col.startswith('-') else (itemgetter(col.strip()), 1))
+                 for col in columns]
+
+    def comparer(left, right):
+        for fn, mult in comparers:
+            result = ((fn(left) > fn(right)) - (fn(left) < fn(right))) * mult
+            if result:
+                return result
+        return 0
+    return sorted(items, key=cmp_to_key(comparer))
+
+
+def _items(num_items=500):
+    rand = random.Random(42)
+    # Few distinct values so there are plenty of ties, `id` keeps track of the order of ties
+    return [{'id': i, 'name': rand.choice('abcde'), 'price': rand.randint(0, 20), 'score': rand.random()}
+            for i in range(num_items)]
+
+
+COLUMNS = [
+    ['name'],
+    ['-price'],
+    ['name', 'price'],
+    ['-name', '-price'],
+    # Mixed directions
+    ['name', '-price'],
+    ['-price', 'name', 'score'],
+]
+
+
+@pytest.mark.parametrize('columns', COLUMNS)
+def test_sort(columns):
+    items = _items()
+    assert multikey_sort(items, columns) == _reference_sort(items, columns)
+
+
+@pytest.mark.parametrize('columns', COLUMNS)
+@pytest.mark.parametrize('limit', [0, 1, 25, 1000])
+def test_limit(columns, limit):
+    items = _items()
+    assert multikey_sort(iter(items), columns, limit=limit) == _reference_sort(items, columns)[:limit]
+
+
+@pytest.mark.parametrize('columns', COLUMNS)
+def test_chunk_size(columns, tmp_path):
+    items = _items()
+    result = multikey_sort(iter(items), columns, chunk_size=64, tmp_dir=str(tmp_path))
+    assert list(result) == _reference_sort(items, columns)
+
+
+def test_input_not_changed():
+    items = _items(20)
+    original = list(items)
+    multikey_sort(items, ['-price'])
+    assert items == original
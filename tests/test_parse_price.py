@@ -0,0 +1,29 @@
+import pytest
+
+from cutil import parse_price, parse_prices
+
+
+@pytest.mark.parametrize('price, kwargs, expected', [
+    ('$1,234.56', {}, (1234.56, None)),
+    ('12.99 - 15.00', {}, (12.99, 15.0)),
+    ('1.234,56 €', {'decimal': ','}, (1234.56, None)),
+    ('1.234,56 €', {'thousands': '.'}, (1234.56, None)),
+    ("CHF 1'234.50", {'thousands': "'"}, (1234.5, None)),
+    ("1'234.50 - 2'000", {'thousands': "'", 'decimal': '.'}, (1234.5, 2000.0)),
+    ('free', {}, (None, None)),
+])
+def test_parse_price(price, kwargs, expected):
+    result = parse_price(price, **kwargs)
+    assert (result['low'], result['high']) == expected
+
+
+def test_invalid_separators():
+    with pytest.raises(ValueError):
+        parse_price('1,5', decimal=',', thousands=',')
+    with pytest.raises(ValueError):
+        parse_price('1,5', thousands='1')
+
+
+def test_parse_prices():
+    result = parse_prices(['$1.00', None, '2 - 3'])
+    assert result == {'low': [1.0, None, 2.0], 'high': [None, None, 3.0]}
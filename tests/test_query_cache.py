@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from cutil.query_cache import QueryCache, tables_in_query
+
+
+@pytest.mark.parametrize('query, tables', [
+    ("SELECT * FROM items", {'items'}),
+    ("SELECT * FROM shop.items i JOIN \"Prices\" p ON p.id = i.id", {'items', 'prices'}),
+    ("SELECT * FROM a, b WHERE a.id = b.id", {'a', 'b'}),
+    ("SELECT * FROM a AS x, b y(c1, c2) LEFT JOIN c USING (id), d", {'a', 'b', 'c', 'd'}),
+    ("SELECT * FROM (SELECT id FROM a) s, b", {'a', 'b'}),
+    ("SELECT * FROM a WHERE id IN (SELECT id FROM b)", {'a', 'b'}),
+    ("SELECT extract(year FROM created), 'FROM x' FROM a -- FROM y", {'a'}),
+])
+def test_tables_in_query(query, tables):
+    assert tables_in_query(query) == tables
+
+
+@pytest.mark.parametrize('query', [
+    # A function in the FROM could read any table
+    "SELECT * FROM a, generate_series(1, 10)",
+    # No tables, so nothing would ever invalidate the result
+    "SELECT nextval('s')",
+    "SELECT my_func(1)",
+    "SELECT now()",
+])
+def test_tables_in_query_unknown(query):
+    assert tables_in_query(query) is None
+
+
+def test_lru():
+    cache = QueryCache(max_size=2)
+    cache.set('a', 1, ['t'])
+    cache.set('b', 2, ['t'])
+    assert cache.get('a') == (True, 1)
+    cache.set('c', 3, ['t'])
+    # `b` was used least recently
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1)
+    assert cache.get('c') == (True, 3)
+
+
+def test_ttl():
+    cache = QueryCache(ttl=0.05)
+    cache.set('a', 1, ['t'])
+    assert cache.get('a') == (True, 1)
+    time.sleep(0.06)
+    assert cache.get('a') == (False, None)
+
+
+def test_invalidate():
+    cache = QueryCache()
+    cache.set('a', 1, ['t1', 't2'])
+    cache.set('b', 2, ['t3'])
+    cache.invalidate('schema."T2"')
+    assert cache.get('a') == (False, None)
+    assert cache.get('b') == (True, 2)
+
+
+def test_set_after_invalidate_is_skipped():
+    cache = QueryCache()
+    generation = cache.generation(['t'])
+    # Table changed while the query was running
+    cache.invalidate('t')
+    cache.set('a', 1, ['t'], generation=generation)
+    assert cache.get('a') == (False, None)
@@ -0,0 +1,86 @@
+import os
+import time
+import asyncio
+
+import pytest
+
+from cutil import RateLimiter, SharedRateLimiter
+
+
+def test_burst_then_throttled():
+    limiter = RateLimiter(10, per=1.0, burst=3)
+    delays = [limiter.reserve() for _ in range(5)]
+    assert delays[:3] == [0.0, 0.0, 0.0]
+    assert delays[3] == pytest.approx(0.1, abs=0.02)
+    assert delays[4] == pytest.approx(0.2, abs=0.02)
+    stats = limiter.stats()
+    assert stats['calls'] == 5
+    assert stats['throttled_calls'] == 2
+
+
+def test_decorator():
+    limiter = RateLimiter(20, per=1.0)
+
+    @limiter
+    def call():
+        return time.monotonic()
+
+    times = [call() for _ in range(5)]
+    assert times[-1] - times[0] >= 4 * 0.05 * 0.9
+    assert call.limiter is limiter
+
+
+def test_async_decorator():
+    limiter = RateLimiter(20, per=1.0)
+
+    @limiter
+    async def call():
+        return time.monotonic()
+
+    async def run():
+        return await asyncio.gather(*[call() for _ in range(5)])
+
+    times = sorted(asyncio.run(run()))
+    assert times[-1] - times[0] >= 4 * 0.05 * 0.9
+
+
+def test_invalid_args():
+    with pytest.raises(ValueError):
+        RateLimiter(0)
+    with pytest.raises(ValueError):
+        RateLimiter(1, burst=0)
+
+
+def test_shared_limit(tmp_path):
+    path = str(tmp_path / 'limit')
+    first = SharedRateLimiter(path, 10, per=1.0)
+    second = SharedRateLimiter(path, 10, per=1.0)
+    try:
+        assert first.reserve() == 0.0
+        # The second limiter sees the call made by the first one
+        assert second.reserve() == pytest.approx(0.1, abs=0.02)
+    finally:
+        first.close()
+        second.close()
+
+
+def test_shared_limit_does_not_follow_symlinks(tmp_path):
+    target = tmp_path / 'target'
+    target.write_bytes(b'')
+    path = tmp_path / 'limit'
+    path.symlink_to(target)
+    limiter = SharedRateLimiter(str(path), 10, per=1.0)
+    with pytest.raises(OSError):
+        limiter.reserve()
+    assert target.read_bytes() == b''
+
+
+def test_shared_limit_file_is_private():
+    limiter = SharedRateLimiter('cutil-test-{0}'.format(os.getpid()), 10, per=1.0)
+    try:
+        limiter.reserve()
+        assert str(os.getuid()) in os.path.basename(limiter.path)
+        assert os.stat(limiter.path).st_mode & 0o077 == 0
+    finally:
+        limiter.close()
+        os.remove(limiter.path)
@@ -0,0 +1,96 @@
+import time
+import threading
+
+from cutil import RepeatingTimer, Scheduler
+
+
+def test_repeating_timer_max_tries():
+    calls = []
+    done = threading.Event()
+
+    def callback():
+        calls.append(1)
+        if len(calls) == 3:
+            done.set()
+
+    timer = RepeatingTimer(0.01, callback, max_tries=3, daemon=True)
+    timer.start()
+    assert done.wait(2)
+    time.sleep(0.05)
+    assert len(calls) == 3
+
+
+def test_cancel():
+    calls = []
+    timer = RepeatingTimer(0.05, calls.append, args=(1,), daemon=True)
+    timer.start()
+    timer.cancel()
+    time.sleep(0.1)
+    assert calls == []
+
+
+def test_slow_timer_does_not_delay_others():
+    started = time.monotonic()
+    ran_at = []
+    done = threading.Event()
+
+    def fast():
+        ran_at.append(time.monotonic() - started)
+        done.set()
+
+    slow = RepeatingTimer(0.01, time.sleep, repeat=False, args=(1,), daemon=True)
+    slow.start()
+    RepeatingTimer(0.1, fast, repeat=False, daemon=True).start()
+    assert done.wait(2)
+    assert ran_at[0] < 0.5
+
+
+def test_scheduler_single_thread_runs_in_order():
+    scheduler = Scheduler(num_threads=1)
+    order = []
+    done = threading.Event()
+    now = time.monotonic()
+    scheduler.schedule(now + 0.02, lambda: order.append(2))
+    scheduler.schedule(now + 0.01, lambda: order.append(1))
+    scheduler.schedule(now + 0.03, done.set)
+    assert done.wait(2)
+    assert order == [1, 2]
+
+
+def _count_thread_starts(monkeypatch):
+    starts = []
+    start = threading.Thread.start
+
+    def counting_start(thread):
+        if thread.name == 'cutil-scheduler':
+            starts.append(thread)
+        start(thread)
+
+    monkeypatch.setattr(threading.Thread, 'start', counting_start)
+    return starts
+
+
+def test_repeating_timer_reuses_thread(monkeypatch):
+    starts = _count_thread_starts(monkeypatch)
+    scheduler = Scheduler(num_threads=4)
+    calls = []
+    timer = RepeatingTimer(0.005, calls.append, args=(1,), scheduler=scheduler)
+    timer.start()
+    time.sleep(0.5)
+    timer.cancel()
+    assert len(calls) > 20
+    assert len(starts) == 1
+
+
+def test_many_timers_do_not_start_a_thread_per_tick(monkeypatch):
+    starts = _count_thread_starts(monkeypatch)
+    scheduler = Scheduler(num_threads=4)
+    calls = []
+    timers = [RepeatingTimer(0.01, calls.append, args=(1,), scheduler=scheduler) for _ in range(50)]
+    for timer in timers:
+        timer.start()
+    time.sleep(0.5)
+    for timer in timers:
+        timer.cancel()
+    assert len(calls) > 500
+    assert len(starts) <= scheduler.num_threads
@@ -0,0 +1,59 @@
+import time
+import itertools
+
+import pytest
+
+from cutil import ThreadPool
+
+
+def _slow_first(item):
+    if item == 0:
+        time.sleep(0.5)
+    return item * 2
+
+
+def test_imap_ordered():
+    with ThreadPool(4) as pool:
+        results = list(pool.imap(_slow_first, range(20)))
+    assert [task.result for task in results] == [i * 2 for i in range(20)]
+
+
+def test_imap_exception_is_returned():
+    def callback(item):
+        if item == 3:
+            raise ValueError("bad item")
+        return item
+
+    with ThreadPool(2) as pool:
+        results = list(pool.imap(callback, range(5)))
+    assert isinstance(results[3].exception, ValueError)
+    assert [task.result for task in results if task.exception is None] == [0, 1, 2, 4]
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_imap_slow_head_does_not_read_ahead(ordered):
+    read = []
+
+    def items():
+        for i in itertools.count():
+            read.append(i)
+            yield i
+
+    with ThreadPool(4, max_pending=8) as pool:
+        results = pool.imap(_slow_first, items(), ordered=ordered)
+        first = next(results)
+        # The slow first item holds back the ordered results, but the input must not run ahead of it
+        assert len(read) <= 8 + 1
+        results.close()
+
+    if ordered:
+        assert first.item == 0
+
+
+def test_map_raises():
+    def callback(item):
+        raise KeyError(item)
+
+    with ThreadPool(2) as pool:
+        with pytest.raises(KeyError):
+            list(pool.map(callback, range(3)))